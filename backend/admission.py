@@ -0,0 +1,285 @@
+"""
+Admission control for the LLM-backed endpoints.
+
+Requests are sorted into lanes by path. Requests in the "llm" lane (QA,
+summarization) go through two checks:
+
+- a token bucket per client address
+- a cap on how many run at once per worker, with a bounded wait queue
+
+Clients are told apart by the peer address uvicorn puts in the ASGI scope.
+Behind a reverse proxy, list the proxy in uvicorn's FORWARDED_ALLOW_IPS so
+the address is taken from its X-Forwarded-For header; headers the client
+sets itself are never trusted.
+
+When either check fails the request is rejected right away with 429 and a
+Retry-After header. It is not left waiting until it times out. Everything
+else (CRUD, metrics) is in the "default" lane and is never queued, so it
+can't get stuck behind RAG work.
+
+One admitted request can fan out into many LLM or embedding calls
+(map-reduce summaries, batch QA, index builds), so the calls themselves are
+also capped by `llm_calls` and `embedding_calls`. Those wait rather than
+fail: the request was already admitted.
+
+Counters live in each worker's memory. So that running more workers
+(WEB_CONCURRENCY, see server.py) doesn't multiply the limits, the rate limit
+and the call caps are server-wide settings and every worker enforces
+1/WEB_CONCURRENCY of them. Connections are spread across the workers by the
+kernel, so a client can be limited slightly early when its requests happen
+to land on one worker, but never late.
+"""
+import asyncio
+import math
+import os
+import re
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+
+from cachetools import TTLCache
+from prometheus_client import Counter, Gauge, Histogram
+from starlette.responses import PlainTextResponse
+
+from config import Settings
+
+# Set by server.py; the limits below are split across this many workers
+WORKERS = max(1, int(os.environ.get("WEB_CONCURRENCY", 1)))
+
+LLM_PATHS = re.compile(r"^/pdfs/(qa-pdf/\d+|\d+/qa-batch|\d+/summarize|summarize-text)$")
+
+QUEUE_DEPTH = Gauge(
+    "admission_queue_depth", "Requests waiting for an LLM slot", ["lane"], multiprocess_mode="livesum"
+)
+IN_FLIGHT = Gauge(
+    "admission_in_flight", "Requests holding an LLM slot", ["lane"], multiprocess_mode="livesum"
+)
+REJECTIONS = Counter("admission_rejections_total", "Requests rejected with 429", ["lane", "reason"])
+ADMITTED = Counter("admission_admitted_total", "Requests admitted", ["lane"])
+CALLS_IN_FLIGHT = Gauge(
+    "model_calls_in_flight", "LLM and embedding calls running", ["kind"], multiprocess_mode="livesum"
+)
+CALLS_WAITING = Gauge(
+    "model_calls_waiting", "LLM and embedding calls waiting for a slot", ["kind"], multiprocess_mode="livesum"
+)
+WAIT_TIME = Histogram(
+    "admission_wait_seconds", "Time spent queued before admission", ["lane"],
+    buckets=(0.01, 0.05, 0.1, 0.5, 1, 2.5, 5, 10, 30),
+)
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def take(self):
+        """Take a token; returns 0 on success or the seconds until one is available"""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+
+class Lane:
+    """Caps concurrent requests, with a bounded queue of waiting requests"""
+
+    def __init__(self, name: str, max_in_flight: int, max_queue: int, queue_timeout: float):
+        self.name = name
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.semaphore = asyncio.Semaphore(max_in_flight)
+        self.waiting = 0
+        # Moving average of how long admitted requests take, for Retry-After
+        self.avg_duration = 1.0
+
+    def retry_after(self):
+        return self.avg_duration * (self.waiting + 1) / self.max_in_flight
+
+    async def acquire(self):
+        """Returns True once admitted, or False if the queue is full or the wait timed out"""
+        if self.semaphore.locked() and self.waiting >= self.max_queue:
+            return False
+        self.waiting += 1
+        QUEUE_DEPTH.labels(self.name).inc()
+        start = time.monotonic()
+        try:
+            await asyncio.wait_for(self.semaphore.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            self.waiting -= 1
+            QUEUE_DEPTH.labels(self.name).dec()
+            WAIT_TIME.labels(self.name).observe(time.monotonic() - start)
+        IN_FLIGHT.labels(self.name).inc()
+        return True
+
+    def release(self, duration: float):
+        self.avg_duration = 0.9 * self.avg_duration + 0.1 * duration
+        IN_FLIGHT.labels(self.name).dec()
+        self.semaphore.release()
+
+
+class CallLimiter:
+    """
+    Caps concurrent calls across the whole process, for callers in thread
+    pool threads (`with limiter.hold():`) and on the event loop
+    (`async with limiter.ahold():`) alike. Waiters get slots in FIFO order.
+    """
+
+    def __init__(self, kind: str, limit: int):
+        self.kind = kind
+        self.limit = limit
+        self.in_use = 0
+        self._lock = threading.Lock()
+        # threading.Event for threads, (loop, future) for coroutines
+        self._waiters = deque()
+
+    def _take(self):
+        if self.in_use < self.limit and not self._waiters:
+            self.in_use += 1
+            return True
+        return False
+
+    def acquire(self):
+        with self._lock:
+            if self._take():
+                return
+            ready = threading.Event()
+            self._waiters.append(ready)
+        CALLS_WAITING.labels(self.kind).inc()
+        try:
+            # The releasing call hands its slot over directly
+            ready.wait()
+        finally:
+            CALLS_WAITING.labels(self.kind).dec()
+
+    async def acquire_async(self):
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if self._take():
+                return
+            ready = loop.create_future()
+            waiter = (loop, ready)
+            self._waiters.append(waiter)
+        CALLS_WAITING.labels(self.kind).inc()
+        try:
+            await ready
+        except asyncio.CancelledError:
+            with self._lock:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+                    raise
+            # The slot was handed over just as we were cancelled
+            if ready.done() and not ready.cancelled():
+                self.release()
+            raise
+        finally:
+            CALLS_WAITING.labels(self.kind).dec()
+
+    def release(self):
+        with self._lock:
+            if not self._waiters:
+                self.in_use -= 1
+                return
+            waiter = self._waiters.popleft()
+        if isinstance(waiter, threading.Event):
+            waiter.set()
+        else:
+            loop, ready = waiter
+            loop.call_soon_threadsafe(self._hand_over, ready)
+
+    def _hand_over(self, ready):
+        if ready.cancelled():
+            # Its waiter gave up; pass the slot on
+            self.release()
+        else:
+            ready.set_result(None)
+
+    @contextmanager
+    def hold(self):
+        self.acquire()
+        CALLS_IN_FLIGHT.labels(self.kind).inc()
+        try:
+            yield
+        finally:
+            CALLS_IN_FLIGHT.labels(self.kind).dec()
+            self.release()
+
+    @asynccontextmanager
+    async def ahold(self):
+        await self.acquire_async()
+        CALLS_IN_FLIGHT.labels(self.kind).inc()
+        try:
+            yield
+        finally:
+            CALLS_IN_FLIGHT.labels(self.kind).dec()
+            self.release()
+
+
+def worker_share(limit):
+    """This worker's part of a server-wide limit, at least 1"""
+    return max(1, limit // WORKERS)
+
+
+_settings = Settings()
+llm_calls = CallLimiter("llm", worker_share(_settings.LLM_MAX_CONCURRENT_CALLS))
+embedding_calls = CallLimiter("embedding", worker_share(_settings.EMBEDDING_MAX_CONCURRENT_CALLS))
+
+
+class AdmissionMiddleware:
+    """ASGI middleware applying the token buckets and lanes described above"""
+
+    def __init__(self, app, settings):
+        self.app = app
+        self.rate = settings.RATE_LIMIT_PER_MINUTE / 60 / WORKERS
+        self.burst = worker_share(settings.RATE_LIMIT_BURST)
+        self.buckets = TTLCache(maxsize=100_000, ttl=max(600, self.burst / self.rate))
+        self.llm_lane = Lane(
+            "llm", settings.LLM_MAX_IN_FLIGHT, settings.LLM_MAX_QUEUE, settings.LLM_QUEUE_TIMEOUT
+        )
+
+    def client_id(self, scope):
+        client = scope.get("client")
+        return client[0] if client else "unknown"
+
+    async def reject(self, scope, receive, send, reason, retry_after):
+        REJECTIONS.labels(self.llm_lane.name, reason).inc()
+        response = PlainTextResponse(
+            "Too many requests, please retry later",
+            status_code=429,
+            headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+        )
+        await response(scope, receive, send)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not LLM_PATHS.match(scope["path"]):
+            await self.app(scope, receive, send)
+            return
+
+        client = self.client_id(scope)
+        bucket = self.buckets.get(client) or TokenBucket(self.rate, self.burst)
+        # Re-inserting keeps active clients from expiring out of the cache
+        self.buckets[client] = bucket
+        wait = bucket.take()
+        if wait:
+            await self.reject(scope, receive, send, "rate_limit", wait)
+            return
+
+        lane = self.llm_lane
+        if not await lane.acquire():
+            await self.reject(scope, receive, send, "overloaded", lane.retry_after())
+            return
+        ADMITTED.labels(lane.name).inc()
+        start = time.monotonic()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            lane.release(time.monotonic() - start)
@@ -0,0 +1,29 @@
+"""add chunking columns to pdfs
+
+Revision ID: 8c1f2d7e4b90
+Revises: 30a84d438097
+Create Date: 2026-10-19 10:12:31.418207
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8c1f2d7e4b90'
+down_revision: Union[str, None] = '30a84d438097'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade():
+    op.add_column('pdfs', sa.Column('chunk_strategy', sa.Text, nullable=True))
+    op.add_column('pdfs', sa.Column('chunk_size', sa.Integer, nullable=True))
+    op.add_column('pdfs', sa.Column('chunk_overlap', sa.Integer, nullable=True))
+
+def downgrade():
+    op.drop_column('pdfs', 'chunk_overlap')
+    op.drop_column('pdfs', 'chunk_size')
+    op.drop_column('pdfs', 'chunk_strategy')
@@ -0,0 +1,42 @@
+"""create pdf_pages table with full-text index
+
+Revision ID: b4e9a1c3d572
+Revises: 8c1f2d7e4b90
+Create Date: 2026-10-19 14:03:52.917634
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b4e9a1c3d572'
+down_revision: Union[str, None] = '8c1f2d7e4b90'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade():
+    op.create_table(
+        'pdf_pages',
+        sa.Column('id', sa.BigInteger, primary_key=True),
+        sa.Column('pdf_id', sa.BigInteger, sa.ForeignKey('pdfs.id', ondelete='CASCADE'), nullable=False),
+        sa.Column('version', sa.Text, nullable=False),
+        sa.Column('page', sa.Integer, nullable=False),
+        sa.Column('content', sa.Text, nullable=False),
+        sa.Column(
+            'tsv',
+            postgresql.TSVECTOR,
+            sa.Computed("to_tsvector('english', content)", persisted=True),
+        ),
+    )
+    op.create_index('ix_pdf_pages_pdf_id', 'pdf_pages', ['pdf_id'])
+    op.create_index('ix_pdf_pages_tsv', 'pdf_pages', ['tsv'], postgresql_using='gin')
+
+def downgrade():
+    op.drop_index('ix_pdf_pages_tsv', table_name='pdf_pages')
+    op.drop_index('ix_pdf_pages_pdf_id', table_name='pdf_pages')
+    op.drop_table('pdf_pages')
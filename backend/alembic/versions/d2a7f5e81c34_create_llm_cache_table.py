@@ -0,0 +1,34 @@
+"""create llm_cache table
+
+Revision ID: d2a7f5e81c34
+Revises: b4e9a1c3d572
+Create Date: 2026-10-19 15:21:07.530981
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd2a7f5e81c34'
+down_revision: Union[str, None] = 'b4e9a1c3d572'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade():
+    op.create_table(
+        'llm_cache',
+        sa.Column('key', sa.Text, primary_key=True),
+        sa.Column('llm_string', sa.Text, nullable=False),
+        sa.Column('response', sa.Text, nullable=False),
+        sa.Column('created_at', sa.Float, nullable=False),
+        sa.Column('last_used_at', sa.Float, nullable=False),
+    )
+    op.create_index('ix_llm_cache_last_used_at', 'llm_cache', ['last_used_at'])
+
+def downgrade():
+    op.drop_index('ix_llm_cache_last_used_at', table_name='llm_cache')
+    op.drop_table('llm_cache')
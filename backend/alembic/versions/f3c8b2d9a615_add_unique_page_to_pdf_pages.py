@@ -0,0 +1,31 @@
+"""add unique (pdf_id, version, page) to pdf_pages
+
+Revision ID: f3c8b2d9a615
+Revises: d2a7f5e81c34
+Create Date: 2026-10-19 18:42:11.204538
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f3c8b2d9a615'
+down_revision: Union[str, None] = 'd2a7f5e81c34'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade():
+    # Overlapping indexing tasks could insert a page twice; keep the first copy
+    op.execute("""
+        DELETE FROM pdf_pages a
+        USING pdf_pages b
+        WHERE a.pdf_id = b.pdf_id AND a.version = b.version AND a.page = b.page AND a.id > b.id
+    """)
+    op.create_unique_constraint('uq_pdf_pages_pdf_id_version_page', 'pdf_pages', ['pdf_id', 'version', 'page'])
+
+def downgrade():
+    op.drop_constraint('uq_pdf_pages_pdf_id_version_page', 'pdf_pages', type_='unique')
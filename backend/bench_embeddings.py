@@ -0,0 +1,75 @@
+# bench_embeddings.py
+"""
+Embedding throughput (chunks/sec) of the local ONNX backend vs. OpenAI.
+
+Chunks come from a PDF split with the default chunking settings. The given
+number of client threads embed them concurrently, the way simultaneous
+indexing requests would, so the ONNX backend's dynamic batching is exercised.
+
+Usage:
+    python bench_embeddings.py --pdf-file allergic.pdf --threads 1,4,16
+    python bench_embeddings.py --pdf-file allergic.pdf --backends onnx --onnx-threads 4
+"""
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+import chunking
+import embeddings as embedding_backends
+import page_text
+from config import Settings
+
+
+def make_backend(name, args):
+    settings = Settings()
+    if name == "onnx":
+        return embedding_backends.OnnxEmbeddings(
+            settings.ONNX_MODEL_DIR,
+            threads=args.onnx_threads,
+            max_length=settings.EMBEDDINGS_MAX_LENGTH,
+            batch_size=args.batch_size,
+            batch_wait_ms=settings.EMBEDDINGS_BATCH_WAIT_MS,
+        )
+    from langchain_openai import OpenAIEmbeddings
+    return OpenAIEmbeddings(openai_api_key=settings.OPENAI_API_KEY)
+
+
+def run(backend, texts, threads, request_size):
+    # Each "request" embeds a slice of the chunks, like one QA index build
+    requests = [texts[i:i + request_size] for i in range(0, len(texts), request_size)]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        list(pool.map(backend.embed_documents, requests))
+    return len(texts) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark embedding backends")
+    parser.add_argument("--pdf-file", required=True)
+    parser.add_argument("--backends", default="onnx,openai")
+    parser.add_argument("--threads", default="1,4,16", help="Concurrent client threads")
+    parser.add_argument("--request-size", type=int, default=16, help="Chunks per embed call")
+    parser.add_argument("--repeat", type=int, default=1, help="Repeat the chunks to get a larger workload")
+    parser.add_argument("--onnx-threads", type=int, default=0)
+    parser.add_argument("--batch-size", type=int, default=64)
+    args = parser.parse_args()
+
+    with open(args.pdf_file, "rb") as f:
+        pages = page_text.extract_pages(f.read())
+    texts = [doc.page_content for doc in chunking.split_pages(pages, *chunking.config_for())] * args.repeat
+    print(f"{len(texts)} chunks")
+
+    for name in args.backends.split(","):
+        backend = make_backend(name, args)
+        backend.embed_documents(texts[:1])  # warm-up: model load / connection setup
+        for threads in [int(t) for t in args.threads.split(",")]:
+            rate = run(backend, texts, threads, args.request_size)
+            print(f"{embedding_backends.model_name(backend):<45} {threads:>3} threads: {rate:8.1f} chunks/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+# bench_server.py
+"""
+Throughput of the production server at different worker counts.
+
+For every worker count the server is started with server.py, warmed up and
+hit with a fixed number of concurrent clients for a fixed time.
+
+Usage:
+    python bench_server.py --workers 1,2,4,8 --path /pdfs --concurrency 64 --duration 20
+"""
+import argparse
+import asyncio
+import os
+import signal
+import statistics
+import subprocess
+import sys
+import time
+
+import httpx
+
+
+async def wait_until_ready(url, timeout=60):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            try:
+                await client.get(url)
+                return
+            except httpx.TransportError:
+                await asyncio.sleep(0.5)
+    raise RuntimeError(f"Server at {url} did not start")
+
+
+async def run_load(url, concurrency, duration):
+    latencies = []
+    errors = 0
+    deadline = time.monotonic() + duration
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(limits=limits, timeout=60) as client:
+        async def client_loop():
+            nonlocal errors
+            while time.monotonic() < deadline:
+                start = time.perf_counter()
+                try:
+                    response = await client.get(url)
+                    if response.status_code >= 500:
+                        errors += 1
+                except httpx.HTTPError:
+                    errors += 1
+                latencies.append(time.perf_counter() - start)
+
+        await asyncio.gather(*(client_loop() for _ in range(concurrency)))
+    return latencies, errors
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def bench(workers, args):
+    bind = f"127.0.0.1:{args.port}"
+    url = f"http://{bind}{args.path}"
+    process = subprocess.Popen(
+        [sys.executable, "server.py", "--workers", str(workers), "--bind", bind],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        asyncio.run(wait_until_ready(url))
+        asyncio.run(run_load(url, args.concurrency, 2))  # warm-up
+        latencies, errors = asyncio.run(run_load(url, args.concurrency, args.duration))
+    finally:
+        process.send_signal(signal.SIGTERM)
+        process.wait()
+
+    print(
+        f"{workers:>3} workers: {len(latencies) / args.duration:8.1f} req/s, "
+        f"p50 {statistics.median(latencies) * 1000:7.1f} ms, "
+        f"p99 {percentile(latencies, 0.99) * 1000:7.1f} ms, "
+        f"{errors} errors"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark server throughput per worker count")
+    parser.add_argument("--workers", default="1,2,4,8")
+    parser.add_argument("--path", default="/pdfs")
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--duration", type=int, default=20)
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    for workers in [int(w) for w in args.workers.split(",")]:
+        bench(workers, args)
+
+
+if __name__ == "__main__":
+    main()
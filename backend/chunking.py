@@ -0,0 +1,176 @@
+"""
+Chunking strategies used to split PDF pages before embedding.
+
+Strategies take the page records from `page_text.get_pages` and return
+LangChain Documents with `page` and `chunk` metadata:
+
+- recursive:     RecursiveCharacterTextSplitter applied page by page (sizes in characters)
+- token:         fixed windows of tiktoken tokens per page (sizes in tokens)
+- sentence:      sentences packed into chunks, a new chunk starts at section headings
+                 (sizes in characters)
+- page_spanning: recursive splitting over the whole document so chunks can cross
+                 page boundaries (sizes in characters)
+"""
+import re
+from functools import lru_cache
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from config import Settings
+
+STRATEGIES = ("recursive", "token", "sentence", "page_spanning")
+
+TOKEN_ENCODING = "cl100k_base"
+
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+(?=[\"'(\[]?[A-Z0-9])")
+# Section headings: a section number ("2.1 Results", "3. Methods") followed by a
+# short capitalized title without sentence punctuation, or a short all-caps line.
+# Plain lines starting with a number (table rows, "2019 saw...") don't qualify.
+_HEADING = re.compile(
+    r"^(\d+(\.\d+)+\.?\s+[A-Z][^.!?;:]{0,60}"
+    r"|\d+\.\s+[A-Z][^.!?;:,]{0,60}"
+    r"|[A-Z][A-Z0-9 ,:&/-]{2,80})$"
+)
+
+
+@lru_cache()
+def get_encoding():
+    import tiktoken
+    return tiktoken.get_encoding(TOKEN_ENCODING)
+
+
+def count_tokens(texts):
+    """Token count of each text, encoded in one batch"""
+    return [len(tokens) for tokens in get_encoding().encode_ordinary_batch(list(texts))]
+
+
+def config_for(pdf=None):
+    """
+    (strategy, chunk_size, chunk_overlap) for a PDF, falling back to the global
+    settings. A PDF that only overrides the size gets the global overlap scaled
+    to it, so a small chunk size doesn't end up overlapping almost entirely.
+    """
+    settings = Settings()
+    strategy = getattr(pdf, "chunk_strategy", None) or settings.CHUNK_STRATEGY
+    chunk_size = getattr(pdf, "chunk_size", None) or settings.CHUNK_SIZE
+    chunk_overlap = getattr(pdf, "chunk_overlap", None)
+    if chunk_overlap is None:
+        chunk_overlap = settings.CHUNK_OVERLAP * chunk_size // settings.CHUNK_SIZE
+    return strategy, chunk_size, max(0, min(chunk_overlap, chunk_size - 1))
+
+
+def _documents(chunks, source):
+    """Build Documents from (page, text) pairs"""
+    return [
+        Document(page_content=text, metadata={"source": source, "page": page, "chunk": i})
+        for i, (page, text) in enumerate(chunks)
+        if text.strip()
+    ]
+
+
+def split_recursive(pages, chunk_size, chunk_overlap):
+    splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    return [
+        (page["page"], text)
+        for page in pages
+        for text in splitter.split_text(page["text"])
+    ]
+
+
+def split_token(pages, chunk_size, chunk_overlap):
+    # Fast path: all pages are encoded in one batch call and the windows are
+    # decoded in one batch call as well
+    encoding = get_encoding()
+    encoded = encoding.encode_ordinary_batch([page["normalized"] for page in pages])
+    step = chunk_size - chunk_overlap
+    numbers = []
+    windows = []
+    for page, tokens in zip(pages, encoded):
+        starts = np.arange(0, max(len(tokens) - chunk_overlap, 1), step)
+        for start in starts:
+            numbers.append(page["page"])
+            windows.append(tokens[start:start + chunk_size])
+    return list(zip(numbers, encoding.decode_batch(windows)))
+
+
+def _sentences(text):
+    """Sentences of a page, with headings returned as separate items flagged True"""
+    for line in re.split(r"\n\s*\n|\n(?=\S)", text or ""):
+        line = " ".join(line.split())
+        if not line:
+            continue
+        if _HEADING.match(line):
+            yield True, line
+        else:
+            for sentence in _SENTENCE_END.split(line):
+                yield False, sentence
+
+
+def split_sentence(pages, chunk_size, chunk_overlap):
+    chunks = []
+    current = []
+    current_len = 0
+    current_page = None
+    # Number of sentences at the start of `current` repeated from the previous chunk
+    carried_count = 0
+
+    def flush(keep_overlap):
+        nonlocal current, current_len, carried_count
+        if len(current) > carried_count:
+            chunks.append((current_page, " ".join(current)))
+        # Carry trailing sentences over as overlap
+        carried = []
+        carried_len = 0
+        if keep_overlap and len(current) > carried_count:
+            for sentence in reversed(current):
+                if carried_len + len(sentence) > chunk_overlap:
+                    break
+                carried.insert(0, sentence)
+                carried_len += len(sentence) + 1
+        current, current_len, carried_count = carried, carried_len, len(carried)
+
+    for page in pages:
+        for is_heading, sentence in _sentences(page["text"]):
+            if is_heading:
+                # Sections never share a chunk
+                flush(keep_overlap=False)
+            elif current_len + len(sentence) > chunk_size and current:
+                flush(keep_overlap=len(current) > carried_count)
+            if not current:
+                current_page = page["page"]
+            current.append(sentence)
+            current_len += len(sentence) + 1
+    flush(keep_overlap=False)
+    return chunks
+
+
+def split_page_spanning(pages, chunk_size, chunk_overlap):
+    text = "\n".join(page["normalized"] for page in pages)
+    splitter = RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size, chunk_overlap=chunk_overlap, add_start_index=True
+    )
+    docs = splitter.create_documents([text])
+    if not docs:
+        return []
+    # Map every chunk start offset to the page it starts on in one vectorized lookup
+    page_offsets = np.array([page["offset"] for page in pages])
+    starts = np.array([doc.metadata["start_index"] for doc in docs])
+    page_index = np.searchsorted(page_offsets, starts, side="right") - 1
+    return [(pages[i]["page"], doc.page_content) for i, doc in zip(page_index, docs)]
+
+
+_SPLITTERS = {
+    "recursive": split_recursive,
+    "token": split_token,
+    "sentence": split_sentence,
+    "page_spanning": split_page_spanning,
+}
+
+
+def split_pages(pages, strategy, chunk_size, chunk_overlap, source=None):
+    """Split page records into Documents with the given strategy"""
+    if strategy not in _SPLITTERS:
+        raise ValueError(f"Unknown chunking strategy: {strategy}")
+    return _documents(_SPLITTERS[strategy](pages, chunk_size, chunk_overlap), source)
@@ -1,4 +1,5 @@
 import os
+from functools import lru_cache
 import boto3
 from pydantic_settings import BaseSettings
 
@@ -13,16 +14,103 @@ class Settings(BaseSettings):
     AWS_SECRET: str
     AWS_S3_BUCKET: str
     OPENAI_API_KEY: str
+    # Optional S3-compatible endpoint, e.g. a local MinIO for development and reconcile.py
+    S3_ENDPOINT_URL: str = ""
+
+    # Admission control for the LLM endpoints (see admission.py). Rate limits
+    # are per client address and for the whole server: each of the
+    # WEB_CONCURRENCY workers enforces its share
+    RATE_LIMIT_PER_MINUTE: float = 30
+    RATE_LIMIT_BURST: int = 10
+    # Per worker; keep below the 40 sync threads so CRUD always has threads left
+    LLM_MAX_IN_FLIGHT: int = 16
+    LLM_MAX_QUEUE: int = 32
+    LLM_QUEUE_TIMEOUT: float = 10
+    # Caps for the whole server on the LLM and embedding API calls those
+    # requests make, split across the workers; one request can make many
+    # (summaries, batch QA, index builds)
+    LLM_MAX_CONCURRENT_CALLS: int = 16
+    EMBEDDING_MAX_CONCURRENT_CALLS: int = 8
+
+    # Default chunking for QA; PDFs can override these (see chunking.py)
+    CHUNK_STRATEGY: str = "recursive"
+    CHUNK_SIZE: int = 1000
+    CHUNK_OVERLAP: int = 200
+
+    # Presigned URLs are signed for 3600 s and reused for this long
+    PRESIGNED_URL_CACHE_TTL: int = 3000
+    # Browser/CDN caching of GET /pdfs/{id}/content
+    PDF_CONTENT_MAX_AGE: int = 3600
+
+    # Persistent LLM completion cache: "off", "readwrite" or "replay" (see llm_cache.py)
+    LLM_CACHE_MODE: str = "readwrite"
+    # Empty uses the app database; e.g. "sqlite:///llm_cache.db" for offline runs
+    LLM_CACHE_URL: str = ""
+    # Seconds, 0 keeps entries until evicted by size
+    LLM_CACHE_TTL: int = 30 * 24 * 3600
+    LLM_CACHE_MAX_ENTRIES: int = 100000
+
+    # Embeddings backend: "openai" or "onnx" (see embeddings.py)
+    EMBEDDINGS_BACKEND: str = "openai"
+    ONNX_MODEL_DIR: str = "models/all-MiniLM-L6-v2"
+    # onnxruntime intra-op threads, 0 lets onnxruntime decide
+    EMBEDDINGS_THREADS: int = 0
+    EMBEDDINGS_MAX_LENGTH: int = 256
+    EMBEDDINGS_BATCH_SIZE: int = 64
+    EMBEDDINGS_BATCH_WAIT_MS: float = 5
+
+    # Per-PDF FAISS indexes on local disk (see index_store.py)
+    INDEX_DIR: str = "indexes"
+    INDEX_CACHE_SIZE: int = 128
+    INDEX_MMAP: bool = True
+
+    # Retrieval for QA: defaults and the limits on request options (see retrieval.py)
+    RETRIEVAL_K: int = 3
+    RETRIEVAL_ADAPTIVE_K: int = 8
+    RETRIEVAL_ADAPTIVE_DROP: float = 0.05
+    RETRIEVAL_MAX_K: int = 20
+    RETRIEVAL_MAX_FETCH_K: int = 100
+    RETRIEVAL_MAX_CONTEXT_TOKENS: int = 6000
+
+    # POST /pdfs/{id}/qa-batch
+    QA_BATCH_MAX_QUESTIONS: int = 50
+    QA_BATCH_MAX_CONCURRENCY: int = 8
+
+    # Request profiling (see profiling.py). Empty token disables profiling on
+    # demand and the /admin/profiles endpoints
+    PROFILE_TOKEN: str = ""
+    PROFILE_SAMPLE_RATE: float = 0
+    PROFILE_INTERVAL_MS: float = 5
+    # The most recent profiles of all workers, kept as files in PROFILE_DIR
+    PROFILE_BUFFER_SIZE: int = 50
+    PROFILE_DIR: str = "profiles"
+
+    # Number of PDFs whose extracted page text is kept in memory
+    PAGE_TEXT_CACHE_SIZE: int = 64
+
+    # Map-reduce summarization of whole PDFs
+    SUMMARY_CHUNK_SIZE: int = 4000
+    SUMMARY_CHUNK_OVERLAP: int = 200
+    SUMMARY_MAX_CONCURRENCY: int = 8
+    SUMMARY_FAN_IN: int = 4
+    SUMMARY_CACHE_SIZE: int = 2048
 
     @staticmethod
     def get_s3_client():
-        settings = Settings()
-        return boto3.client(
-            's3',
-            aws_access_key_id=settings.AWS_KEY,
-            aws_secret_access_key=settings.AWS_SECRET
-        )
+        # boto3 clients are thread-safe, so one per process is shared
+        return _s3_client()
 
     class Config:
         env_file = ".env"
         extra = "ignore"
+
+
+@lru_cache()
+def _s3_client():
+    settings = Settings()
+    return boto3.client(
+        's3',
+        aws_access_key_id=settings.AWS_KEY,
+        aws_secret_access_key=settings.AWS_SECRET,
+        endpoint_url=settings.S3_ENDPOINT_URL or None
+    )
@@ -4,9 +4,16 @@ import models, schemas
 from config import Settings
 from botocore.exceptions import NoCredentialsError, BotoCoreError
 import urllib.parse
+import requests
+from threading import Lock
+from cachetools import TTLCache
+import page_text
 
 def create_pdf(db: Session, pdf: schemas.PDFRequest):
-    db_pdf = models.PDF(name=pdf.name, selected=pdf.selected, file=pdf.file)
+    db_pdf = models.PDF(
+        name=pdf.name, selected=pdf.selected, file=pdf.file,
+        chunk_strategy=pdf.chunk_strategy, chunk_size=pdf.chunk_size, chunk_overlap=pdf.chunk_overlap
+    )
     db.add(db_pdf)
     db.commit()
     db.refresh(db_pdf)
@@ -21,6 +28,28 @@ def read_pdfs(db: Session, selected: bool = None):
 def read_pdf(db: Session, id: int):
     return db.query(models.PDF).filter(models.PDF.id == id).first()
 
+def get_pdf_version(db_pdf: models.PDF):
+    """Short content version of a PDF, see schemas.content_version"""
+    return schemas.content_version(db_pdf.file)
+
+def get_s3_key(file_url: str):
+    """Return the S3 object key for one of our S3 URLs, or None for other URLs"""
+    if not file_url or 's3.amazonaws.com/' not in file_url:
+        return None
+    # URL decode in case the key has URL-encoded characters
+    return urllib.parse.unquote(file_url.split('amazonaws.com/')[1])
+
+def read_pdf_bytes(db_pdf: models.PDF):
+    """Download the raw bytes of a stored PDF"""
+    file_key = get_s3_key(db_pdf.file)
+    if file_key is None:
+        response = requests.get(db_pdf.file, timeout=60)
+        response.raise_for_status()
+        return response.content
+    settings = Settings()
+    s3_client = Settings.get_s3_client()
+    return s3_client.get_object(Bucket=settings.AWS_S3_BUCKET, Key=file_key)['Body'].read()
+
 def update_pdf(db: Session, id: int, pdf: schemas.PDFRequest):
     db_pdf = db.query(models.PDF).filter(models.PDF.id == id).first()
     if db_pdf is None:
@@ -50,8 +79,7 @@ def delete_pdf(db: Session, id: int):
             BUCKET_NAME = settings.AWS_S3_BUCKET
             
             # Extract the key (filename) from the URL
-            file_key = file_url.split('amazonaws.com/')[1]
-            file_key = urllib.parse.unquote(file_key)
+            file_key = get_s3_key(file_url)
             
             # Check if file exists in S3 before attempting deletion
             try:
@@ -71,7 +99,18 @@ def delete_pdf(db: Session, id: int):
                     # Other error - log but mark as failed
                     print(f"S3 error checking file existence: {str(e)}")
                     s3_delete_success = False
-                
+
+            # Derived page text stored next to the PDF, deleted even when the
+            # PDF itself is already gone (deleting a missing key is a no-op)
+            try:
+                s3_client.delete_object(
+                    Bucket=BUCKET_NAME,
+                    Key=page_text.sidecar_key(file_key)
+                )
+            except s3_client.exceptions.ClientError as e:
+                print(f"S3 error deleting page text of {file_key}: {str(e)}")
+                s3_delete_success = False
+
         except (NoCredentialsError, BotoCoreError) as e:
             # Log error and mark S3 deletion as failed
             print(f"Error with S3 credentials or connection: {str(e)}")
@@ -93,6 +132,10 @@ def delete_pdf(db: Session, id: int):
                     Bucket=BUCKET_NAME,
                     Key=file_key
                 )
+                s3_client.delete_object(
+                    Bucket=BUCKET_NAME,
+                    Key=page_text.sidecar_key(file_key)
+                )
                 print(f"Successfully deleted S3 object on retry: {file_key}")
             except Exception as retry_error:
                 print(f"Failed to delete S3 object on retry: {str(retry_error)}")
@@ -171,27 +214,39 @@ def upload_pdf(db: Session, file: UploadFile, file_name: str):
         # Convert other exceptions to HTTP 500
         raise HTTPException(status_code=500, detail=f"Error uploading PDF: {str(e)}")
 
+# Signed URLs are reused until shortly before they expire
+_presigned_url_cache = TTLCache(maxsize=4096, ttl=Settings().PRESIGNED_URL_CACHE_TTL)
+_presigned_url_lock = Lock()
+
 def get_presigned_url(pdf_id: int, db: Session, expiration=3600):
     """Generate a pre-signed URL for temporary access to S3 object"""
     db_pdf = read_pdf(db, pdf_id)
     if db_pdf is None:
         return None
-        
+    return presign_pdf_url(db_pdf, expiration)
+
+def presign_pdf_url(db_pdf: models.PDF, expiration=3600):
+    """Pre-signed URL for an already loaded PDF, served from cache while still fresh"""
     file_url = db_pdf.file
-    if not file_url or 's3.amazonaws.com/' not in file_url:
+    # Extract the key (filename) from the URL
+    file_key = get_s3_key(file_url)
+    if file_key is None:
         return file_url  # Return original URL if not an S3 URL
+
+    # Only cache URLs that stay valid for a while after the cache entry expires
+    cacheable = expiration > _presigned_url_cache.ttl + 60
+    cache_key = (file_key, expiration)
+    if cacheable:
+        with _presigned_url_lock:
+            presigned_url = _presigned_url_cache.get(cache_key)
+        if presigned_url is not None:
+            return presigned_url
         
     try:
         settings = Settings()
         s3_client = Settings.get_s3_client()
         BUCKET_NAME = settings.AWS_S3_BUCKET
         
-        # Extract the key (filename) from the URL
-        file_key = file_url.split('amazonaws.com/')[1]
-        
-        # URL decode in case the key has URL-encoded characters
-        file_key = urllib.parse.unquote(file_key)
-        
         # Generate presigned URL
         presigned_url = s3_client.generate_presigned_url(
             'get_object',
@@ -202,11 +257,32 @@ def get_presigned_url(pdf_id: int, db: Session, expiration=3600):
             ExpiresIn=expiration
         )
         
+        if cacheable:
+            with _presigned_url_lock:
+                _presigned_url_cache[cache_key] = presigned_url
         return presigned_url
     except (NoCredentialsError, BotoCoreError) as e:
         print(f"Error generating presigned URL: {str(e)}")
         return file_url  # Fall back to the original URL
 
+def open_pdf_stream(db_pdf: models.PDF, byte_range: str = None):
+    """
+    Open the S3 object of a PDF for streaming, optionally only a byte range
+    ("bytes=start-end"). Returns the boto3 get_object response.
+    """
+    settings = Settings()
+    s3_client = Settings.get_s3_client()
+    params = {'Bucket': settings.AWS_S3_BUCKET, 'Key': get_s3_key(db_pdf.file)}
+    if byte_range:
+        params['Range'] = byte_range
+    return s3_client.get_object(**params)
+
+def get_pdf_size(db_pdf: models.PDF):
+    """Size in bytes of the S3 object of a PDF"""
+    settings = Settings()
+    s3_client = Settings.get_s3_client()
+    return s3_client.head_object(Bucket=settings.AWS_S3_BUCKET, Key=get_s3_key(db_pdf.file))['ContentLength']
+
 
 # def upload_pdf(db: Session, file: UploadFile, file_name: str):
 #     s3_client = Settings.get_s3_client()
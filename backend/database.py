@@ -1,7 +1,11 @@
 import os
-from sqlalchemy import create_engine
+import time
+from contextlib import contextmanager
+from sqlalchemy import create_engine, event
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool, QueuePool
+from prometheus_client import Gauge, Histogram
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -16,9 +20,95 @@ db_name = os.environ['DATABASE_NAME']
 
 SQLALCHEMY_DATABASE_URL = f"postgresql://{user}:{password}@{host}:{port}/{db_name}"
 
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL
+# Connection pool settings. DB_MAX_CONNECTIONS is the budget for the whole
+# server and is split across its worker processes (WEB_CONCURRENCY, set by
+# server.py), keeping headroom under Postgres' default max_connections=100.
+# Sessions are released before slow work (see session_scope), so a worker
+# needs far fewer connections than it has threads.
+DB_MAX_CONNECTIONS = int(os.environ.get('DB_MAX_CONNECTIONS', 80))
+WORKERS = max(1, int(os.environ.get('WEB_CONCURRENCY', 1)))
+_worker_connections = max(2, min(20, DB_MAX_CONNECTIONS // WORKERS))
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', _worker_connections // 2))
+DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', _worker_connections - _worker_connections // 2))
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 10))
+DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', 1800))
+DB_POOL_PRE_PING = os.environ.get('DB_POOL_PRE_PING', 'true').lower() == 'true'
+# Behind PgBouncer (transaction pooling) PgBouncer does the pooling, so keep no
+# connections open in the app
+DB_PGBOUNCER = os.environ.get('DB_PGBOUNCER', 'false').lower() == 'true'
+
+POOL_CHECKOUT_WAIT = Histogram(
+    'db_pool_checkout_wait_seconds',
+    'Time spent waiting for a database connection from the pool',
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
 )
+
+
+class TimedQueuePool(QueuePool):
+    """QueuePool that records how long each checkout waited"""
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            POOL_CHECKOUT_WAIT.observe(time.perf_counter() - start)
+
+
+if DB_PGBOUNCER:
+    engine = create_engine(
+        SQLALCHEMY_DATABASE_URL,
+        poolclass=NullPool,
+    )
+else:
+    engine = create_engine(
+        SQLALCHEMY_DATABASE_URL,
+        poolclass=TimedQueuePool,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+        pool_pre_ping=DB_POOL_PRE_PING,
+    )
+
+    # Callback gauges don't work in prometheus_client's multiprocess mode
+    # (server.py), so checkouts are counted as they happen
+    POOL_CHECKED_OUT = Gauge(
+        'db_pool_checked_out', 'Database connections currently checked out', multiprocess_mode='livesum'
+    )
+    event.listen(engine.pool, 'checkout', lambda *args: POOL_CHECKED_OUT.inc())
+    event.listen(engine.pool, 'checkin', lambda *args: POOL_CHECKED_OUT.dec())
+    Gauge(
+        'db_pool_size', 'Configured database pool size plus overflow, per worker', multiprocess_mode='max'
+    ).set(DB_POOL_SIZE + DB_MAX_OVERFLOW)
+
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
-Base = declarative_base()
\ No newline at end of file
+Base = declarative_base()
+
+
+@contextmanager
+def session_scope():
+    """
+    Short-lived session for endpoints that do slow work (downloads, embeddings,
+    LLM calls) after reading from the database, so the connection goes back to
+    the pool before that work starts. Loaded objects stay usable after the block.
+    """
+    db = SessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+def check_connection_budget(workers: int):
+    """Fail fast when the pools of all workers could exceed DB_MAX_CONNECTIONS"""
+    if DB_PGBOUNCER:
+        return
+    total = workers * (DB_POOL_SIZE + DB_MAX_OVERFLOW)
+    if total > DB_MAX_CONNECTIONS:
+        raise RuntimeError(
+            f"{workers} workers x {DB_POOL_SIZE + DB_MAX_OVERFLOW} pooled connections = {total}, "
+            f"more than DB_MAX_CONNECTIONS={DB_MAX_CONNECTIONS}; lower DB_POOL_SIZE/DB_MAX_OVERFLOW "
+            f"or the number of workers"
+        )
@@ -0,0 +1,183 @@
+"""
+Embedding backends.
+
+EMBEDDINGS_BACKEND selects one:
+
+- openai: OpenAIEmbeddings over the network (default)
+- onnx:   a small sentence-embedding model (e.g. all-MiniLM-L6-v2 exported to
+          ONNX) run locally on CPU with onnxruntime. ONNX_MODEL_DIR must hold
+          `model.onnx` and `tokenizer.json`.
+
+Calls to the ONNX backend from concurrent requests are merged into shared
+batches by one background thread per process.
+"""
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from functools import lru_cache
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from config import Settings
+
+
+class DynamicBatcher:
+    """
+    Collects texts from concurrent callers and runs them through `run_batch`
+    together: a batch is sent once it has `max_batch_size` texts or the oldest
+    text has waited `max_wait_ms`.
+    """
+
+    def __init__(self, run_batch, max_batch_size: int = 64, max_wait_ms: float = 5):
+        self.run_batch = run_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def _ensure_started(self):
+        # Threads don't survive fork, so start one lazily in every worker process
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                self._queue = queue.Queue()
+                threading.Thread(target=self._loop, daemon=True, name="embedding-batcher").start()
+                self._pid = os.getpid()
+
+    def submit(self, texts):
+        """Embed texts, blocking until their batch has run"""
+        self._ensure_started()
+        future = Future()
+        self._queue.put((list(texts), future))
+        return future.result()
+
+    def _loop(self):
+        jobs_queue = self._queue
+        while True:
+            jobs = [jobs_queue.get()]
+            size = len(jobs[0][0])
+            deadline = time.monotonic() + self.max_wait
+            while size < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    job = jobs_queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                jobs.append(job)
+                size += len(job[0])
+
+            texts = [text for job_texts, _ in jobs for text in job_texts]
+            try:
+                vectors = self.run_batch(texts)
+            except Exception as e:
+                for _, future in jobs:
+                    future.set_exception(e)
+                continue
+            start = 0
+            for job_texts, future in jobs:
+                future.set_result(vectors[start:start + len(job_texts)])
+                start += len(job_texts)
+
+
+class OnnxEmbeddings(Embeddings):
+    """Mean-pooled, normalized sentence embeddings from a local ONNX model"""
+
+    def __init__(self, model_dir: str, threads: int = 0, max_length: int = 256,
+                 batch_size: int = 64, batch_wait_ms: float = 5):
+        self.model_dir = model_dir
+        self.model = os.path.basename(os.path.normpath(model_dir))
+        self.threads = threads
+        self.max_length = max_length
+        self.batch_size = batch_size
+        self._session = None
+        self._session_pid = None
+        self._session_lock = threading.Lock()
+        self.batcher = DynamicBatcher(self._embed_batch, batch_size, batch_wait_ms)
+
+    def _load(self):
+        import onnxruntime
+        from tokenizers import Tokenizer
+
+        tokenizer = Tokenizer.from_file(os.path.join(self.model_dir, "tokenizer.json"))
+        tokenizer.enable_truncation(max_length=self.max_length)
+        tokenizer.enable_padding()  # pad to the longest text of each batch
+
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if self.threads:
+            options.intra_op_num_threads = self.threads
+        options.inter_op_num_threads = 1
+        session = onnxruntime.InferenceSession(
+            os.path.join(self.model_dir, "model.onnx"), options, providers=["CPUExecutionProvider"]
+        )
+        return tokenizer, session
+
+    def _get_session(self):
+        # Sessions are not shared across fork; each worker loads its own
+        if self._session_pid != os.getpid():
+            with self._session_lock:
+                if self._session_pid != os.getpid():
+                    self._session = self._load()
+                    self._session_pid = os.getpid()
+        return self._session
+
+    def _embed_batch(self, texts):
+        tokenizer, session = self._get_session()
+        input_names = {i.name for i in session.get_inputs()}
+        # Sort by length so each sub-batch pads as little as possible
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        results = [None] * len(texts)
+        for start in range(0, len(order), self.batch_size):
+            ids = order[start:start + self.batch_size]
+            encodings = tokenizer.encode_batch([texts[i] for i in ids])
+            input_ids = np.array([e.ids for e in encodings], dtype=np.int64)
+            attention_mask = np.array([e.attention_mask for e in encodings], dtype=np.int64)
+            feeds = {"input_ids": input_ids, "attention_mask": attention_mask}
+            if "token_type_ids" in input_names:
+                feeds["token_type_ids"] = np.zeros_like(input_ids)
+            hidden = session.run(None, feeds)[0]
+            mask = attention_mask[:, :, None].astype(np.float32)
+            pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+            pooled /= np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+            for i, vector in zip(ids, pooled):
+                results[i] = vector
+        return np.vstack(results).tolist()
+
+    def embed_documents(self, texts):
+        if not texts:
+            return []
+        return self.batcher.submit(texts)
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+
+@lru_cache()
+def get_embeddings():
+    """The embeddings backend configured for this process"""
+    settings = Settings()
+    if settings.EMBEDDINGS_BACKEND == "onnx":
+        return OnnxEmbeddings(
+            settings.ONNX_MODEL_DIR,
+            threads=settings.EMBEDDINGS_THREADS,
+            max_length=settings.EMBEDDINGS_MAX_LENGTH,
+            batch_size=settings.EMBEDDINGS_BATCH_SIZE,
+            batch_wait_ms=settings.EMBEDDINGS_BATCH_WAIT_MS,
+        )
+    if settings.EMBEDDINGS_BACKEND == "openai":
+        from langchain_openai import OpenAIEmbeddings
+        return OpenAIEmbeddings(openai_api_key=settings.OPENAI_API_KEY)
+    raise ValueError(f"Unknown embeddings backend: {settings.EMBEDDINGS_BACKEND}")
+
+
+def model_name(embeddings):
+    """Identifies the model that produced a set of vectors"""
+    model = getattr(embeddings, "model", None) or getattr(embeddings, "model_name", None) or "unknown"
+    return f"{type(embeddings).__name__}:{model}"
@@ -0,0 +1,202 @@
+"""
+Per-PDF FAISS indexes persisted on local disk.
+
+Each index lives in its own directory under INDEX_DIR, named after the PDF,
+its version and the chunking settings it was built with:
+
+    <INDEX_DIR>/<pdf_id>-<version>-<strategy>-<size>-<overlap>-<model>/
+        index.faiss    FAISS index (memory-mapped when loaded)
+        docstore.pkl   chunk texts and metadata
+        meta.json      how the index was built, including the embedding model
+
+`<model>` is a short hash of the embedding model, and an index is only ever
+loaded for the model recorded in its meta.json, so vectors from different
+embedding models are never mixed.
+
+Indexes are built on first use and kept in a per-process LRU. `preload()` is
+called by the production server before forking workers, so the loaded indexes
+are shared copy-on-write between them.
+"""
+import hashlib
+import json
+import os
+import pickle
+import shutil
+import tempfile
+import time
+from threading import Lock
+
+from cachetools import LRUCache
+
+import chunking
+import crud
+from admission import embedding_calls
+import embeddings as embedding_backends
+from config import Settings
+
+settings = Settings()
+
+_cache = LRUCache(maxsize=settings.INDEX_CACHE_SIZE)
+_lock = Lock()
+# Index name -> lock held while that index is loaded or built, so concurrent
+# first requests for a PDF wait for one build instead of each embedding it
+_name_locks = {}
+
+
+class EmbeddingModelMismatch(ValueError):
+    """An index was built with a different embedding model than the one in use"""
+
+
+def index_name(pdf, chunk_config, embeddings):
+    strategy, chunk_size, chunk_overlap = chunk_config
+    model = hashlib.sha1(embedding_backends.model_name(embeddings).encode("utf-8")).hexdigest()[:8]
+    return f"{pdf.id}-{crud.get_pdf_version(pdf)}-{strategy}-{chunk_size}-{chunk_overlap}-{model}"
+
+
+def _read(path, embeddings):
+    import faiss
+    from langchain_community.vectorstores import FAISS
+
+    with open(os.path.join(path, "meta.json")) as f:
+        meta = json.load(f)
+    expected = embedding_backends.model_name(embeddings)
+    if meta.get("embedding_model") != expected:
+        raise EmbeddingModelMismatch(
+            f"Index {os.path.basename(path)} was built with {meta.get('embedding_model')}, not {expected}"
+        )
+
+    index_path = os.path.join(path, "index.faiss")
+    index = None
+    if settings.INDEX_MMAP:
+        try:
+            index = faiss.read_index(index_path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+        except RuntimeError:
+            # Not every index type can be memory-mapped
+            index = None
+    if index is None:
+        index = faiss.read_index(index_path)
+    with open(os.path.join(path, "docstore.pkl"), "rb") as f:
+        docstore, index_to_docstore_id = pickle.load(f)
+    return FAISS(embeddings, index, docstore, index_to_docstore_id)
+
+
+def _write(path, vectorstore, meta):
+    import faiss
+
+    os.makedirs(settings.INDEX_DIR, exist_ok=True)
+    # Write into a temporary directory and rename it, so readers never see a partial index
+    tmp_path = tempfile.mkdtemp(dir=settings.INDEX_DIR, prefix=".building-")
+    try:
+        faiss.write_index(vectorstore.index, os.path.join(tmp_path, "index.faiss"))
+        with open(os.path.join(tmp_path, "docstore.pkl"), "wb") as f:
+            pickle.dump((vectorstore.docstore, vectorstore.index_to_docstore_id), f)
+        with open(os.path.join(tmp_path, "meta.json"), "w") as f:
+            json.dump(meta, f)
+        os.rename(tmp_path, path)
+    except OSError:
+        # Another worker finished the same index first
+        shutil.rmtree(tmp_path, ignore_errors=True)
+
+
+def get_index(pdf, load_pages, embeddings=None):
+    """
+    FAISS vector store for a PDF with its current chunking settings, loading it
+    from disk or building it from `load_pages()` the first time.
+    Returns None if the PDF has no text to index.
+    """
+    embeddings = embeddings or embedding_backends.get_embeddings()
+    chunk_config = chunking.config_for(pdf)
+    name = index_name(pdf, chunk_config, embeddings)
+    with _lock:
+        vectorstore = _cache.get(name)
+    if vectorstore is not None:
+        return vectorstore
+
+    with _lock:
+        name_lock = _name_locks.setdefault(name, Lock())
+    try:
+        with name_lock:
+            with _lock:
+                vectorstore = _cache.get(name)
+            if vectorstore is None:
+                vectorstore = _load_or_build(pdf, load_pages, embeddings, chunk_config, name)
+                if vectorstore is not None:
+                    with _lock:
+                        _cache[name] = vectorstore
+    finally:
+        with _lock:
+            if _name_locks.get(name) is name_lock and not name_lock.locked():
+                del _name_locks[name]
+    return vectorstore
+
+
+def _load_or_build(pdf, load_pages, embeddings, chunk_config, name):
+    from langchain_community.vectorstores import FAISS
+
+    path = os.path.join(settings.INDEX_DIR, name)
+    if os.path.isdir(path):
+        return _read(path, embeddings)
+
+    chunks = chunking.split_pages(load_pages(), *chunk_config, source=pdf.file)
+    if not chunks:
+        return None
+    print(f"Building index {name} from {len(chunks)} chunks")
+    with embedding_calls.hold():
+        vectorstore = FAISS.from_documents(chunks, embeddings)
+    strategy, chunk_size, chunk_overlap = chunk_config
+    _write(path, vectorstore, {
+        "pdf_id": pdf.id,
+        "version": crud.get_pdf_version(pdf),
+        "chunk_strategy": strategy,
+        "chunk_size": chunk_size,
+        "chunk_overlap": chunk_overlap,
+        "chunks": len(chunks),
+        "embedding_model": embedding_backends.model_name(embeddings),
+        "created": time.time(),
+    })
+    return vectorstore
+
+
+def preload(limit=None):
+    """
+    Load the most recently built indexes into memory, replacing the current
+    cache. Requests already holding an index keep using it.
+    """
+    global _cache
+    if not os.path.isdir(settings.INDEX_DIR):
+        return 0
+    limit = limit or settings.INDEX_CACHE_SIZE
+    paths = [
+        os.path.join(settings.INDEX_DIR, name)
+        for name in os.listdir(settings.INDEX_DIR)
+        if not name.startswith(".")
+    ]
+    paths.sort(key=os.path.getmtime, reverse=True)
+
+    cache = LRUCache(maxsize=settings.INDEX_CACHE_SIZE)
+    embeddings = embedding_backends.get_embeddings()
+    # Oldest first, so the most recent indexes end up most recently used
+    for path in reversed(paths[:limit]):
+        try:
+            cache[os.path.basename(path)] = _read(path, embeddings)
+        except EmbeddingModelMismatch:
+            # Built for another embeddings backend; not usable by this one
+            continue
+        except Exception as e:
+            print(f"Error preloading index {path}: {str(e)}")
+    with _lock:
+        _cache = cache
+    print(f"Preloaded {len(cache)} indexes")
+    return len(cache)
+
+
+def delete_for_pdf(pdf_id: int):
+    """Remove every index built for a PDF from memory and disk"""
+    prefix = f"{pdf_id}-"
+    with _lock:
+        for name in [n for n in _cache.keys() if n.startswith(prefix)]:
+            del _cache[name]
+    if os.path.isdir(settings.INDEX_DIR):
+        for name in os.listdir(settings.INDEX_DIR):
+            if name.startswith(prefix):
+                shutil.rmtree(os.path.join(settings.INDEX_DIR, name), ignore_errors=True)
@@ -0,0 +1,140 @@
+"""
+Persistent cache of LLM completions.
+
+All our chains run at temperature 0, so the same rendered prompt sent to the
+same model with the same parameters gets (effectively) the same completion.
+Completions are stored in the `llm_cache` table, keyed by a SHA-256 of the
+model/parameter string LangChain builds for the LLM and the full prompt. The
+table lives in the app's Postgres database (shared by all workers), or in the
+database at LLM_CACHE_URL, e.g. a SQLite file for CI.
+
+LLM_CACHE_MODE:
+- off:       no caching
+- readwrite: serve hits, store misses (default)
+- replay:    serve hits only; a miss raises LLMCacheMiss instead of calling
+             the API, so tests and benchmarks run offline at zero cost.
+             Combine with EMBEDDINGS_BACKEND=onnx to also avoid network calls
+             for embeddings.
+"""
+import hashlib
+import json
+import random
+import time
+
+from langchain_core.caches import BaseCache
+from langchain_core.load import dumps, loads
+from sqlalchemy import create_engine, delete, insert, select, update
+from sqlalchemy.exc import IntegrityError
+
+import models
+from config import Settings
+
+# Refresh last_used_at on hits at most this often, to avoid a write per hit
+TOUCH_INTERVAL = 3600
+# Expired and excess entries are pruned on roughly one in this many writes
+PRUNE_EVERY = 100
+
+
+class LLMCacheMiss(RuntimeError):
+    """Raised in replay mode when a prompt has no cached completion"""
+
+
+def cache_key(prompt: str, llm_string: str):
+    return hashlib.sha256(f"{llm_string}\x00{prompt}".encode("utf-8")).hexdigest()
+
+
+class SQLLLMCache(BaseCache):
+    """LangChain LLM cache stored in a SQL table, with TTL and size limits"""
+
+    def __init__(self, engine, replay: bool = False, ttl: int = 0, max_entries: int = 0):
+        self.engine = engine
+        self.replay = replay
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.table = models.LLMCacheEntry.__table__
+
+    def lookup(self, prompt: str, llm_string: str):
+        key = cache_key(prompt, llm_string)
+        now = time.time()
+        with self.engine.connect() as connection:
+            row = connection.execute(
+                select(self.table.c.response, self.table.c.created_at, self.table.c.last_used_at)
+                .where(self.table.c.key == key)
+            ).first()
+        if row is not None and self.ttl and now - row.created_at > self.ttl:
+            row = None
+        if row is None:
+            if self.replay:
+                raise LLMCacheMiss(f"No cached completion for prompt {hashlib.sha256(prompt.encode()).hexdigest()[:12]}")
+            return None
+        if now - row.last_used_at > TOUCH_INTERVAL:
+            with self.engine.begin() as connection:
+                connection.execute(
+                    update(self.table).where(self.table.c.key == key).values(last_used_at=now)
+                )
+        return [loads(generation) for generation in json.loads(row.response)]
+
+    def update(self, prompt: str, llm_string: str, return_val):
+        if self.replay:
+            return
+        now = time.time()
+        values = {
+            "key": cache_key(prompt, llm_string),
+            "llm_string": llm_string,
+            "response": json.dumps([dumps(generation) for generation in return_val]),
+            "created_at": now,
+            "last_used_at": now,
+        }
+        try:
+            with self.engine.begin() as connection:
+                connection.execute(delete(self.table).where(self.table.c.key == values["key"]))
+                connection.execute(insert(self.table).values(**values))
+        except IntegrityError:
+            # Another worker stored the same completion at the same time
+            pass
+        if random.randrange(PRUNE_EVERY) == 0:
+            self.prune()
+
+    def prune(self):
+        """Drop expired entries and the least recently used ones beyond max_entries"""
+        with self.engine.begin() as connection:
+            if self.ttl:
+                connection.execute(delete(self.table).where(self.table.c.created_at < time.time() - self.ttl))
+            if self.max_entries:
+                cutoff = connection.execute(
+                    select(self.table.c.last_used_at)
+                    .order_by(self.table.c.last_used_at.desc())
+                    .offset(self.max_entries)
+                    .limit(1)
+                ).scalar()
+                if cutoff is not None:
+                    connection.execute(delete(self.table).where(self.table.c.last_used_at <= cutoff))
+
+    def clear(self, **kwargs):
+        with self.engine.begin() as connection:
+            connection.execute(delete(self.table))
+
+
+def get_llm_cache():
+    """The LLM cache configured for this process, or None when caching is off"""
+    settings = Settings()
+    if settings.LLM_CACHE_MODE == "off":
+        return None
+    if settings.LLM_CACHE_MODE not in ("readwrite", "replay"):
+        raise ValueError(f"Unknown LLM cache mode: {settings.LLM_CACHE_MODE}")
+
+    if settings.LLM_CACHE_URL:
+        engine = create_engine(settings.LLM_CACHE_URL)
+        # Stand-alone cache databases (e.g. SQLite in CI) aren't managed by Alembic
+        models.LLMCacheEntry.__table__.create(engine, checkfirst=True)
+        # This runs at import, in the gunicorn master under server.py; don't let
+        # forked workers inherit its pooled connection (SQLite can't share one)
+        engine.dispose()
+    else:
+        from database import engine
+    return SQLLLMCache(
+        engine,
+        replay=settings.LLM_CACHE_MODE == "replay",
+        ttl=settings.LLM_CACHE_TTL,
+        max_entries=settings.LLM_CACHE_MAX_ENTRIES,
+    )
@@ -6,16 +6,30 @@ from fastapi import FastAPI, Depends
 from fastapi.responses import PlainTextResponse
 from starlette.exceptions import HTTPException as StarletteHTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from prometheus_client import CollectorRegistry, make_asgi_app, multiprocess
 
 # routers: comment out next line till create them
-from routers import pdfs
+from routers import pdfs, admin
 
 import config
+from admission import AdmissionMiddleware
+from profiling import ProfilingMiddleware
 
 app = FastAPI()
 
 # router: comment out next line till create it
 app.include_router(pdfs.router)
+app.include_router(admin.router)
+
+# Prometheus metrics (DB pool usage, ...), aggregated across workers under server.py
+def metrics_app():
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return make_asgi_app(registry=registry)
+    return make_asgi_app()
+
+app.mount("/metrics", metrics_app())
 
 
 origins = [
@@ -23,6 +37,13 @@ origins = [
     os.environ.get("FRONTEND_URL", "")
 ]
 
+# Rate limiting and concurrency caps for the LLM endpoints. Added before CORS
+# so 429 responses still carry CORS headers.
+app.add_middleware(AdmissionMiddleware, settings=config.Settings())
+
+# Opt-in request profiling; wraps admission so queueing time shows up too
+app.add_middleware(ProfilingMiddleware, settings=config.Settings())
+
 # CORS configuration - allow all origins in development
 app.add_middleware(
     CORSMiddleware,
@@ -1,4 +1,5 @@
-from sqlalchemy import Boolean, Column, LargeBinary, Integer, Text
+from sqlalchemy import BigInteger, Boolean, Column, Computed, Float, ForeignKey, Index, LargeBinary, Integer, Text, UniqueConstraint
+from sqlalchemy.dialects.postgresql import TSVECTOR
 from database import Base
 
 class PDF(Base):
@@ -7,4 +8,36 @@ class PDF(Base):
     id = Column(Integer, primary_key=True, index=True)
     name = Column(Text)
     file = Column(Text)
-    selected = Column(Boolean, default=False)
\ No newline at end of file
+    selected = Column(Boolean, default=False)
+    # Per-PDF chunking overrides, NULL means use the global settings
+    chunk_strategy = Column(Text, nullable=True)
+    chunk_size = Column(Integer, nullable=True)
+    chunk_overlap = Column(Integer, nullable=True)
+
+class PDFPage(Base):
+    """Extracted text of one PDF page, full-text indexed for search"""
+    __tablename__ = "pdf_pages"
+
+    # BIGINT like pdfs.id in the migrations
+    id = Column(BigInteger, primary_key=True)
+    pdf_id = Column(BigInteger, ForeignKey("pdfs.id", ondelete="CASCADE"), nullable=False, index=True)
+    version = Column(Text, nullable=False)
+    page = Column(Integer, nullable=False)
+    content = Column(Text, nullable=False)
+    tsv = Column(TSVECTOR, Computed("to_tsvector('english', content)", persisted=True))
+
+    __table_args__ = (
+        Index("ix_pdf_pages_tsv", "tsv", postgresql_using="gin"),
+        UniqueConstraint("pdf_id", "version", "page", name="uq_pdf_pages_pdf_id_version_page"),
+    )
+
+class LLMCacheEntry(Base):
+    """Cached LLM completion, see llm_cache.py"""
+    __tablename__ = "llm_cache"
+
+    # sha256 of the model/parameter string and the rendered prompt
+    key = Column(Text, primary_key=True)
+    llm_string = Column(Text, nullable=False)
+    response = Column(Text, nullable=False)
+    created_at = Column(Float, nullable=False)
+    last_used_at = Column(Float, nullable=False, index=True)
@@ -0,0 +1,121 @@
+"""
+Per-page text extracted from stored PDFs.
+
+A PDF never changes once uploaded, so its text is extracted once and saved as
+gzip-compressed JSON lines next to the PDF in S3 (`<key>.pages.jsonl.gz`).
+The first line is a header, then one line per page:
+
+    {"page": 0, "offset": 0, "text": "...", "normalized": "..."}
+
+`offset` is where the page starts in the normalized pages joined by "\\n",
+so chunks of the whole document can be mapped back to page numbers.
+"""
+import gzip
+import io
+import json
+import re
+import unicodedata
+from threading import Lock
+
+from cachetools import LRUCache
+from pypdf import PdfReader
+
+import crud
+from config import Settings
+
+FORMAT_VERSION = 1
+SIDECAR_SUFFIX = ".pages.jsonl.gz"
+
+settings = Settings()
+
+# Parsed pages of recently used PDFs, keyed by (pdf_id, version)
+_cache = LRUCache(maxsize=settings.PAGE_TEXT_CACHE_SIZE)
+_cache_lock = Lock()
+
+
+def sidecar_key(file_key: str):
+    return file_key + SIDECAR_SUFFIX
+
+
+def normalize_text(text: str):
+    """Layout-free form of a page: joins hyphenated line breaks and collapses whitespace"""
+    text = unicodedata.normalize("NFKC", text or "")
+    text = re.sub(r"(\w)-\s*\n\s*(\w)", r"\1\2", text)
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def extract_pages(pdf_bytes: bytes):
+    """Run pypdf over a PDF and return its page records"""
+    reader = PdfReader(io.BytesIO(pdf_bytes))
+    pages = []
+    offset = 0
+    for number, page in enumerate(reader.pages):
+        text = page.extract_text() or ""
+        normalized = normalize_text(text)
+        pages.append({"page": number, "offset": offset, "text": text, "normalized": normalized})
+        offset += len(normalized) + 1
+    return pages
+
+
+def encode_pages(pages, version: str):
+    lines = [json.dumps({"format": FORMAT_VERSION, "version": version, "pages": len(pages)})]
+    lines.extend(json.dumps(page, ensure_ascii=False) for page in pages)
+    return gzip.compress("\n".join(lines).encode("utf-8"), compresslevel=6)
+
+
+def decode_pages(data: bytes, version: str):
+    """Return the page records, or None if the data is from another format or PDF version"""
+    lines = gzip.decompress(data).decode("utf-8").split("\n")
+    header = json.loads(lines[0])
+    if header.get("format") != FORMAT_VERSION or header.get("version") != version:
+        return None
+    return [json.loads(line) for line in lines[1:] if line]
+
+
+def _read_sidecar(s3_client, file_key: str, version: str):
+    try:
+        response = s3_client.get_object(Bucket=settings.AWS_S3_BUCKET, Key=sidecar_key(file_key))
+    except s3_client.exceptions.NoSuchKey:
+        return None
+    return decode_pages(response["Body"].read(), version)
+
+
+def _write_sidecar(s3_client, file_key: str, pages, version: str):
+    try:
+        s3_client.put_object(
+            Bucket=settings.AWS_S3_BUCKET,
+            Key=sidecar_key(file_key),
+            Body=encode_pages(pages, version),
+            ContentType="application/x-ndjson",
+            ContentEncoding="gzip",
+        )
+    except Exception as e:
+        # The text is still usable; it will just be extracted again next time
+        print(f"Error saving page text for {file_key}: {str(e)}")
+
+
+def get_pages(db_pdf):
+    """
+    Page records for a stored PDF, from memory, the S3 sidecar or, the first
+    time only, by downloading and parsing the PDF.
+    """
+    version = crud.get_pdf_version(db_pdf)
+    cache_key = (db_pdf.id, version)
+    with _cache_lock:
+        pages = _cache.get(cache_key)
+    if pages is not None:
+        return pages
+
+    file_key = crud.get_s3_key(db_pdf.file)
+    s3_client = Settings.get_s3_client() if file_key else None
+    if file_key:
+        pages = _read_sidecar(s3_client, file_key, version)
+    if pages is None:
+        print(f"Extracting page text for PDF {db_pdf.id}")
+        pages = extract_pages(crud.read_pdf_bytes(db_pdf))
+        if file_key:
+            _write_sidecar(s3_client, file_key, pages, version)
+
+    with _cache_lock:
+        _cache[cache_key] = pages
+    return pages
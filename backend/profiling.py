@@ -0,0 +1,297 @@
+"""
+On-demand profiling of single requests.
+
+A request is profiled when it carries `X-Profile-Token: <PROFILE_TOKEN>`, or
+at random with probability PROFILE_SAMPLE_RATE. While it runs, a sampling
+thread records the Python stack of the event loop thread, and of any thread
+inside a `stage()` block of the request, every PROFILE_INTERVAL_MS. Each
+profile also records the request's stage timings and tags (such as pdf_id).
+
+Finished profiles are written to PROFILE_DIR, which all workers of the
+server share, and the last PROFILE_BUFFER_SIZE of them are kept. So the id
+returned in the `X-Profile-Id` header can be looked up on any worker.
+routers/admin.py serves them in the collapsed-stack format read by
+flamegraph.pl and speedscope.
+
+Sampling is used rather than cProfile because sync endpoints run in the
+thread pool and cProfile only sees the thread that enables it. The event
+loop thread is shared, so its samples can include other requests' work.
+
+Unprofiled requests cost one header lookup and, with sampling on, one
+random number; `stage()` does nothing outside a profiled request.
+"""
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from starlette.concurrency import run_in_threadpool
+
+from config import Settings
+
+_current = ContextVar("profile", default=None)
+_settings = Settings()
+
+PDF_ID_PATH = re.compile(r"^/pdfs/(?:qa-pdf/)?(\d+)(?:/|$)")
+PROFILE_ID = re.compile(r"^[0-9a-f]{32}$")
+MAX_DEPTH = 128
+
+
+class Profile:
+    def __init__(self, method, path, reason):
+        # Unique across workers and restarts
+        self.id = uuid.uuid4().hex
+        self.pid = os.getpid()
+        self.method = method
+        self.path = path
+        self.reason = reason
+        self.started = time.time()
+        self.duration_ms = None
+        self.status = None
+        self.tags = {}
+        self.stages = []
+        self.samples = 0
+        self.stacks = Counter()
+        # Thread id -> label of the threads being sampled
+        self.threads = {}
+        self._lock = threading.Lock()
+
+    def watch(self, thread_id, label):
+        with self._lock:
+            previous = self.threads.get(thread_id)
+            self.threads[thread_id] = label
+        return previous
+
+    def unwatch(self, thread_id, previous):
+        with self._lock:
+            if previous is None:
+                self.threads.pop(thread_id, None)
+            else:
+                self.threads[thread_id] = previous
+
+    def sample(self, frames):
+        with self._lock:
+            threads = list(self.threads.items())
+        for thread_id, label in threads:
+            frame = frames.get(thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None and len(stack) < MAX_DEPTH:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            stack.append(label)
+            self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+    def summary(self):
+        return {
+            "id": self.id,
+            "pid": self.pid,
+            "method": self.method,
+            "path": self.path,
+            "reason": self.reason,
+            "started": self.started,
+            "duration_ms": self.duration_ms,
+            "status": self.status,
+            "tags": self.tags,
+            "stages": self.stages,
+            "samples": self.samples,
+        }
+
+
+
+class Sampler:
+    """One thread per process sampling the stacks of all running profiles"""
+
+    def __init__(self, interval_ms: float):
+        self.interval = interval_ms / 1000
+        self.active = set()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._pid = None
+
+    def _ensure_started(self):
+        # Threads don't survive fork, so start one lazily in every worker process
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                self.active = set()
+                threading.Thread(target=self._loop, daemon=True, name="profile-sampler").start()
+                self._pid = os.getpid()
+
+    def start(self, profile):
+        self._ensure_started()
+        with self._lock:
+            self.active.add(profile)
+        self._wake.set()
+
+    def stop(self, profile):
+        with self._lock:
+            self.active.discard(profile)
+
+    def _loop(self):
+        while True:
+            with self._lock:
+                profiles = list(self.active)
+            if not profiles:
+                self._wake.wait()
+                self._wake.clear()
+                continue
+            frames = sys._current_frames()
+            for profile in profiles:
+                profile.sample(frames)
+            del frames
+            time.sleep(self.interval)
+
+
+class ProfilingMiddleware:
+    """Profiles requests selected by the admin token header or by sampling"""
+
+    def __init__(self, app, settings):
+        self.app = app
+        self.token = settings.PROFILE_TOKEN.encode("latin-1")
+        self.sample_rate = settings.PROFILE_SAMPLE_RATE
+        self.sampler = Sampler(settings.PROFILE_INTERVAL_MS)
+
+    def reason(self, scope):
+        if self.token:
+            for name, value in scope.get("headers", []):
+                if name == b"x-profile-token" and value == self.token:
+                    return "header"
+        if self.sample_rate and random.random() < self.sample_rate:
+            return "sampled"
+        return None
+
+    async def __call__(self, scope, receive, send):
+        profiled = scope["type"] == "http" and not scope["path"].startswith("/admin/")
+        reason = self.reason(scope) if profiled else None
+        if reason is None:
+            await self.app(scope, receive, send)
+            return
+
+        profile = Profile(scope["method"], scope["path"], reason)
+        match = PDF_ID_PATH.match(scope["path"])
+        if match:
+            profile.tags["pdf_id"] = int(match.group(1))
+
+        async def send_with_id(message):
+            if message["type"] == "http.response.start":
+                profile.status = message["status"]
+                message["headers"] = list(message.get("headers", [])) + [
+                    (b"x-profile-id", profile.id.encode("latin-1"))
+                ]
+            await send(message)
+
+        token = _current.set(profile)
+        profile.watch(threading.get_ident(), "event loop")
+        self.sampler.start(profile)
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            profile.duration_ms = round((time.perf_counter() - start) * 1000, 2)
+            self.sampler.stop(profile)
+            _current.reset(token)
+            await run_in_threadpool(save, profile)
+
+
+@contextmanager
+def stage(name):
+    """
+    Time a stage of the current request and sample the calling thread while
+    it runs. Does nothing when the request isn't being profiled.
+    """
+    profile = _current.get()
+    if profile is None:
+        yield
+        return
+    thread_id = threading.get_ident()
+    previous = profile.watch(thread_id, f"stage:{name}")
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.stages.append({"stage": name, "ms": round((time.perf_counter() - start) * 1000, 2)})
+        profile.unwatch(thread_id, previous)
+
+
+def _path(profile_id):
+    return os.path.join(_settings.PROFILE_DIR, f"{profile_id}.json")
+
+
+def _stored():
+    """Paths of the stored profiles, newest first"""
+    try:
+        entries = [entry for entry in os.scandir(_settings.PROFILE_DIR) if entry.name.endswith(".json")]
+    except FileNotFoundError:
+        return []
+    by_age = []
+    for entry in entries:
+        try:
+            by_age.append((entry.stat().st_mtime, entry.path))
+        except FileNotFoundError:
+            # Pruned by another worker
+            pass
+    return [path for _, path in sorted(by_age, reverse=True)]
+
+
+def save(profile):
+    """Write a finished profile to PROFILE_DIR and drop the oldest beyond PROFILE_BUFFER_SIZE"""
+    try:
+        os.makedirs(_settings.PROFILE_DIR, exist_ok=True)
+        path = _path(profile.id)
+        with open(f"{path}.{os.getpid()}.tmp", "w") as f:
+            json.dump(dict(profile.summary(), stacks=profile.stacks.most_common()), f)
+        os.replace(f"{path}.{os.getpid()}.tmp", path)
+        for old in _stored()[_settings.PROFILE_BUFFER_SIZE:]:
+            try:
+                os.remove(old)
+            except FileNotFoundError:
+                pass
+    except OSError as e:
+        print(f"Error saving profile {profile.id}: {str(e)}")
+
+
+def _load(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def recent_profiles():
+    """Summaries of the stored profiles of all workers, newest first"""
+    profiles = (_load(path) for path in _stored())
+    return [
+        {key: value for key, value in profile.items() if key != "stacks"}
+        for profile in profiles
+        if profile is not None
+    ]
+
+
+def get_profile(profile_id: str):
+    """A stored profile as folded stacks, one `frame;frame;frame count` line per distinct stack"""
+    if not PROFILE_ID.match(profile_id):
+        return None
+    profile = _load(_path(profile_id))
+    if profile is None:
+        return None
+    return "".join(f"{stack} {count}\n" for stack, count in profile["stacks"])
+
+
+def tag(**tags):
+    """Attach tags to the current request's profile, if it is being profiled"""
+    profile = _current.get()
+    if profile is not None:
+        profile.tags.update(tags)
@@ -0,0 +1,486 @@
+"""
+Reconcile S3 objects, local indexes and the `pdfs` table.
+
+Partial failures in upload/delete can leave S3 objects without a row, rows
+whose object is gone, and derived artifacts (page text sidecars, FAISS
+indexes) for PDFs that no longer exist. This job:
+
+1. Lists the bucket with list_objects_v2 (keys come back sorted) while a
+   server-side cursor reads the pdfs table ordered by file, and diffs the
+   two with a sorted merge, so memory stays constant however many objects
+   there are. A `<key>.pages.jsonl.gz` sidecar belongs to the PDF at `<key>`.
+   - objects with no row are orphans and are deleted in batches of 1000
+   - rows whose PDF object is missing are reported
+   - missing page text sidecars are rebuilt with --rebuild
+   Keys are compared as S3 lists them, i.e. the URL path exactly as stored
+   (upload_pdf doesn't encode it). The app reads the URL-decoded key, so for
+   the few rows whose URL contains `%` both keys count as theirs.
+   With --delete, the diff first runs as a dry pass and only a pass that
+   completes without finding unsorted input is repeated with deletes.
+2. Removes index directories under INDEX_DIR for deleted PDFs, old PDF
+   versions or old chunking settings, and with --rebuild builds the index
+   of every PDF that has none.
+
+Nothing is deleted without --delete. Objects modified within --grace-minutes
+are left alone, since an upload writes the object before committing its row.
+Set S3_ENDPOINT_URL to run against a local S3 stand-in such as MinIO.
+
+Usage:
+    python reconcile.py                     # report only
+    python reconcile.py --delete --rebuild
+
+The merge and diff logic only use the standard library and take their
+inputs as iterators, so they can be tested without S3 or Postgres
+(test_reconcile.py). The app modules are imported when the job runs.
+"""
+import argparse
+import heapq
+import itertools
+import os
+import queue
+import shutil
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+
+# delete_objects accepts at most this many keys per call
+DELETE_BATCH_SIZE = 1000
+DB_BATCH_SIZE = 1000
+
+PDF = "pdf"
+SIDECAR = "sidecar"
+
+
+class OutOfOrder(RuntimeError):
+    """A stream the merge relies on was not sorted; deleting based on it would be unsafe"""
+
+
+def checked_sorted(items, name):
+    """Pass (key, ...) tuples through, failing if the keys ever go backwards"""
+    previous = None
+    for item in items:
+        if previous is not None and item[0] < previous:
+            raise OutOfOrder(f"{name} not sorted: {item[0]!r} after {previous!r}")
+        previous = item[0]
+        yield item
+
+
+def prefetch(items, depth=2):
+    """Produce `items` in a background thread, up to `depth` ahead of the consumer"""
+    buffer = queue.Queue(maxsize=depth)
+    done = object()
+
+    def produce():
+        try:
+            for item in items:
+                buffer.put(item)
+        except Exception as e:
+            buffer.put(e)
+        buffer.put(done)
+
+    threading.Thread(target=produce, daemon=True, name="reconcile-prefetch").start()
+    while True:
+        item = buffer.get()
+        if item is done:
+            return
+        if isinstance(item, Exception):
+            raise item
+        yield item
+
+
+def s3_objects(s3_client, bucket, prefix=""):
+    """Objects of the bucket, in key order, one page of up to 1000 at a time"""
+    paginator = s3_client.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix, PaginationConfig={"PageSize": 1000}):
+        yield page.get("Contents", [])
+
+
+def bucket_url(bucket):
+    return f"https://{bucket}.s3.amazonaws.com/"
+
+
+def db_rows(bucket, suffix=""):
+    """
+    (id, file, key) of every PDF stored in the bucket, from a server-side
+    cursor, in the order of `key + suffix`. `key` is the URL path as stored,
+    the key upload_pdf wrote the object under.
+    """
+    from sqlalchemy import select
+
+    import models
+    from database import session_scope
+
+    prefix = bucket_url(bucket)
+    query = (
+        select(models.PDF.id, models.PDF.file)
+        .where(models.PDF.file.startswith(prefix))
+        # Byte order, the order S3 lists keys in
+        .order_by((models.PDF.file + suffix).collate("C"))
+        .execution_options(yield_per=DB_BATCH_SIZE)
+    )
+    with session_scope() as db:
+        for row in db.execute(query):
+            yield row.id, row.file, row.file[len(prefix):]
+
+
+def decoded_rows(bucket):
+    """
+    (id, file, decoded key) of the PDFs whose URL path URL-decodes to another
+    key, the one crud.get_s3_key reads. Only URLs containing `%` qualify, so
+    this is loaded into memory.
+    """
+    from sqlalchemy import select
+
+    import crud
+    import models
+    from database import session_scope
+
+    prefix = bucket_url(bucket)
+    query = select(models.PDF.id, models.PDF.file).where(
+        models.PDF.file.startswith(prefix), models.PDF.file.contains("%", autoescape=True)
+    )
+    with session_scope() as db:
+        rows = db.execute(query).all()
+    return [
+        (row.id, row.file, crud.get_s3_key(row.file))
+        for row in rows
+        if crud.get_s3_key(row.file) != row.file[len(prefix):]
+    ]
+
+
+def expected_keys(pdf_rows, sidecar_rows, sidecar_key, decoded=()):
+    """
+    Every object the table says should exist, in key order: each PDF and its
+    page text sidecar, as (key, kind, pdf_id, file, alternate). `pdf_rows`
+    and `sidecar_rows` are two streams of (id, file, key) rows, e.g. two
+    cursors, ordered by PDF key and by sidecar key respectively. A sidecar key
+    doesn't sort next to its PDF's key, and when one key is a prefix of another
+    ("a.pdf", "a.pdf-2.pdf") their sidecars even sort the other way round.
+
+    `decoded` lists (id, file, key) rows with a second, URL-decoded key. The
+    objects of those rows may exist under either key, so all their items are
+    flagged `alternate`.
+    """
+    decoded = list(decoded)
+    alternates = {pdf_id for pdf_id, _, _ in decoded}
+    pdfs = ((key, PDF, pdf_id, file, pdf_id in alternates) for pdf_id, file, key in pdf_rows)
+    sidecars = (
+        (sidecar_key(key), SIDECAR, pdf_id, file, pdf_id in alternates) for pdf_id, file, key in sidecar_rows
+    )
+    decoded_items = sorted(
+        [(key, PDF, pdf_id, file, True) for pdf_id, file, key in decoded]
+        + [(sidecar_key(key), SIDECAR, pdf_id, file, True) for pdf_id, file, key in decoded]
+    )
+    merged = heapq.merge(
+        checked_sorted(pdfs, "pdfs table"),
+        checked_sorted(sidecars, "pdfs table sidecars"),
+        decoded_items,
+        key=lambda item: item[0],
+    )
+    # Rows sharing a key expect the same object; a row that can only be
+    # judged by that key takes precedence
+    for _, group in itertools.groupby(merged, key=lambda item: item[0]):
+        yield min(group, key=lambda item: item[4])
+
+
+def actual_keys(pages):
+    """(key, size, last_modified) of the objects in listing pages"""
+    for page in pages:
+        for obj in page:
+            yield obj["Key"], obj["Size"], obj["LastModified"]
+
+
+def merge(left, right):
+    """Sorted merge of two key-sorted streams, yielding (key, left item or None, right item or None)"""
+    left = iter(left)
+    right = iter(right)
+    l = next(left, None)
+    r = next(right, None)
+    while l is not None or r is not None:
+        if r is None or (l is not None and l[0] < r[0]):
+            yield l[0], l, None
+            l = next(left, None)
+        elif l is None or r[0] < l[0]:
+            yield r[0], None, r
+            r = next(right, None)
+        else:
+            yield l[0], l, r
+            l = next(left, None)
+            r = next(right, None)
+
+
+class Deleter:
+    """Deletes S3 keys in batches of up to DELETE_BATCH_SIZE"""
+
+    def __init__(self, s3_client, bucket, dry_run):
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.dry_run = dry_run
+        self.batch = []
+        self.deleted = 0
+        self.bytes = 0
+        self.failed = 0
+
+    def add(self, key, size):
+        self.batch.append((key, size))
+        if len(self.batch) >= DELETE_BATCH_SIZE:
+            self.flush()
+
+    def discard(self):
+        """Drop the queued keys without deleting them"""
+        self.batch = []
+
+    def flush(self):
+        batch, self.batch = self.batch, []
+        if not batch:
+            return
+        failed = set()
+        if not self.dry_run:
+            response = self.s3_client.delete_objects(
+                Bucket=self.bucket,
+                Delete={"Objects": [{"Key": key} for key, _ in batch], "Quiet": True},
+            )
+            for error in response.get("Errors", []):
+                print(f"Error deleting {error['Key']}: {error.get('Message')}")
+                failed.add(error["Key"])
+        for key, size in batch:
+            if key in failed:
+                self.failed += 1
+            else:
+                self.deleted += 1
+                self.bytes += size
+
+
+def diff_objects(expected, actual, deleter, cutoff, rebuild_sidecar=None):
+    """
+    Merge the key-ordered `expected_keys` and `actual_keys` streams: objects
+    nobody expects (and older than `cutoff`) go to `deleter`, missing PDFs
+    are reported and missing sidecars are passed to `rebuild_sidecar(pdf_id,
+    file)` if given. Returns counts.
+    """
+    stats = {"objects": 0, "missing_pdfs": 0, "missing_sidecars": 0, "rebuilt_sidecars": 0, "recent": 0}
+    # PDFs found missing so far; a sidecar always sorts after its PDF
+    missing_pdf_ids = set()
+    # pdf_id -> (file, kinds found) of rows whose objects may be under either
+    # of two keys; they are judged once the merge is done
+    alternates = {}
+
+    def missing(key, kind, pdf_id, file):
+        if kind == PDF:
+            print(f"PDF {pdf_id} points to missing object {key}")
+            stats["missing_pdfs"] += 1
+            missing_pdf_ids.add(pdf_id)
+        elif pdf_id not in missing_pdf_ids:
+            stats["missing_sidecars"] += 1
+            if rebuild_sidecar is not None and rebuild_sidecar(pdf_id, file):
+                stats["rebuilt_sidecars"] += 1
+
+    expected = checked_sorted(expected, "pdfs table")
+    actual = checked_sorted(actual, "S3 listing")
+    try:
+        for key, want, have in merge(expected, actual):
+            if have is not None:
+                stats["objects"] += 1
+            if want is None:
+                _, size, last_modified = have
+                if last_modified > cutoff:
+                    stats["recent"] += 1
+                    continue
+                print(f"Orphaned object: {key} ({size} bytes)")
+                deleter.add(key, size)
+            elif want[4]:
+                _, kind, pdf_id, file, _ = want
+                found = alternates.setdefault(pdf_id, (file, set()))[1]
+                if have is not None:
+                    found.add(kind)
+            elif have is None:
+                missing(key, *want[1:4])
+    except OutOfOrder:
+        # Keys queued since the last flush may have been misjudged as orphans
+        deleter.discard()
+        raise
+    deleter.flush()
+
+    for pdf_id, (file, found) in alternates.items():
+        for kind in (PDF, SIDECAR):
+            if kind not in found:
+                missing(file, kind, pdf_id, file)
+
+    stats.update(orphans=deleter.deleted, orphan_bytes=deleter.bytes, delete_errors=deleter.failed)
+    return stats
+
+
+def diff_and_delete(streams, s3_client, bucket, dry_run, cutoff, rebuild_sidecar=None):
+    """
+    `diff_objects` over the (expected, actual) iterators returned by
+    `streams()`. Deleting runs as a second pass, after a dry pass has gone
+    through both streams without raising OutOfOrder, so unsorted input is
+    caught before any batch is deleted.
+    """
+    if not dry_run:
+        diff_objects(*streams(), Deleter(s3_client, bucket, dry_run=True), cutoff)
+    return diff_objects(*streams(), Deleter(s3_client, bucket, dry_run), cutoff, rebuild_sidecar)
+
+
+def reconcile_objects(settings, s3_client, dry_run=True, rebuild=False, grace=timedelta(hours=1), prefix=""):
+    import page_text
+
+    bucket = settings.AWS_S3_BUCKET
+
+    def streams():
+        expected = expected_keys(
+            db_rows(bucket),
+            db_rows(bucket, page_text.SIDECAR_SUFFIX),
+            page_text.sidecar_key,
+            decoded_rows(bucket),
+        )
+        expected = (item for item in expected if item[0].startswith(prefix))
+        return expected, actual_keys(prefetch(s3_objects(s3_client, bucket, prefix)))
+
+    return diff_and_delete(
+        streams,
+        s3_client,
+        bucket,
+        dry_run,
+        datetime.now(timezone.utc) - grace,
+        rebuild_page_text if rebuild else None,
+    )
+
+
+class _StoredPDF:
+    """The columns page_text and index_store read, without holding a session"""
+
+    def __init__(self, pdf_id, file, chunk_strategy=None, chunk_size=None, chunk_overlap=None):
+        self.id = pdf_id
+        self.file = file
+        self.chunk_strategy = chunk_strategy
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+
+
+def rebuild_page_text(pdf_id, file):
+    import page_text
+
+    try:
+        page_text.get_pages(_StoredPDF(pdf_id, file))
+        return True
+    except Exception as e:
+        print(f"Error rebuilding page text of PDF {pdf_id}: {str(e)}")
+        return False
+
+
+def directory_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+def reconcile_indexes(settings, dry_run=True, rebuild=False, grace=timedelta(hours=1)):
+    """Remove index directories no current PDF would load, and optionally build missing ones"""
+    from sqlalchemy import select
+
+    import chunking
+    import crud
+    import embeddings as embedding_backends
+    import index_store
+    import models
+    import page_text
+    from database import session_scope
+
+    stats = {"stale_indexes": 0, "index_bytes": 0, "missing_indexes": 0, "rebuilt_indexes": 0}
+    embeddings = embedding_backends.get_embeddings()
+
+    # Index directory names, grouped by PDF id; one entry per directory on local disk
+    by_pdf = {}
+    stale = []
+    if os.path.isdir(settings.INDEX_DIR):
+        cutoff = time.time() - grace.total_seconds()
+        for entry in os.scandir(settings.INDEX_DIR):
+            if entry.name.startswith("."):
+                # Temporary directory of a build that never finished
+                if entry.stat().st_mtime < cutoff:
+                    stale.append(entry.path)
+                continue
+            pdf_id = entry.name.split("-", 1)[0]
+            if pdf_id.isdigit():
+                by_pdf.setdefault(int(pdf_id), set()).add(entry.name)
+
+    query = (
+        select(models.PDF.id, models.PDF.file, models.PDF.chunk_strategy, models.PDF.chunk_size, models.PDF.chunk_overlap)
+        .order_by(models.PDF.id)
+        .execution_options(yield_per=DB_BATCH_SIZE)
+    )
+    with session_scope() as db:
+        for row in db.execute(query):
+            pdf = _StoredPDF(*row)
+            current = index_store.index_name(pdf, chunking.config_for(pdf), embeddings)
+            names = by_pdf.pop(pdf.id, set())
+            if current not in names:
+                stats["missing_indexes"] += 1
+                if rebuild and crud.get_s3_key(pdf.file):
+                    try:
+                        if index_store.get_index(pdf, lambda: page_text.get_pages(pdf), embeddings) is not None:
+                            stats["rebuilt_indexes"] += 1
+                    except Exception as e:
+                        print(f"Error rebuilding index of PDF {pdf.id}: {str(e)}")
+            # Indexes built with another embeddings backend are kept; they are
+            # in use wherever that backend is configured
+            model_suffix = current.rsplit("-", 1)[1]
+            stale.extend(
+                os.path.join(settings.INDEX_DIR, name)
+                for name in names
+                if name != current and name.endswith(model_suffix)
+            )
+    # Whatever is left belongs to deleted PDFs
+    stale.extend(os.path.join(settings.INDEX_DIR, name) for names in by_pdf.values() for name in names)
+
+    for path in stale:
+        print(f"Stale index: {path}")
+        stats["stale_indexes"] += 1
+        stats["index_bytes"] += directory_size(path)
+        if not dry_run:
+            shutil.rmtree(path, ignore_errors=True)
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--delete", action="store_true", help="Delete orphaned objects and stale indexes")
+    parser.add_argument("--rebuild", action="store_true", help="Rebuild missing page text and indexes")
+    parser.add_argument("--grace-minutes", type=float, default=60, help="Leave objects modified this recently alone")
+    parser.add_argument("--prefix", default="", help="Only reconcile keys with this prefix")
+    parser.add_argument("--skip-indexes", action="store_true", help="Only reconcile S3 objects")
+    args = parser.parse_args()
+
+    from dotenv import load_dotenv
+    load_dotenv()
+    from config import Settings
+    settings = Settings()
+
+    dry_run = not args.delete
+    grace = timedelta(minutes=args.grace_minutes)
+    started = time.monotonic()
+
+    stats = reconcile_objects(settings, Settings.get_s3_client(), dry_run, args.rebuild, grace, args.prefix)
+    if not args.skip_indexes:
+        stats.update(reconcile_indexes(settings, dry_run, args.rebuild, grace))
+
+    action = "Would reclaim" if dry_run else "Reclaimed"
+    print("-" * 50)
+    for name, value in stats.items():
+        print(f"{name}: {value}")
+    print(
+        f"{action} {stats['orphan_bytes'] / 1024 ** 2:.1f} MiB in S3 ({stats['orphans']} objects)"
+        + (f" and {stats['index_bytes'] / 1024 ** 2:.1f} MiB of indexes" if "index_bytes" in stats else "")
+        + f" in {time.monotonic() - started:.0f} s"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+"""
+Query-time retrieval over a PDF's FAISS index.
+
+Search modes (`RetrievalOptions.mode`):
+
+- similarity: the k nearest chunks
+- mmr:        maximal marginal relevance over the `fetch_k` nearest chunks,
+              trading relevance for diversity with `lambda_mult`
+- adaptive:   up to k nearest chunks, cut off at the first chunk whose score
+              drops more than `adaptive_drop` below the previous one
+
+Scores are cosine similarities (higher is better). The selected chunks are
+then filtered by `score_threshold` and trimmed to `max_context_tokens`, always
+keeping the first chunk that passes the threshold.
+
+Request values are checked against the RETRIEVAL_* limits in Settings.
+"""
+from dataclasses import dataclass
+from typing import Optional
+
+import numpy as np
+
+import chunking
+from config import Settings
+
+
+class RetrievalLimitExceeded(ValueError):
+    """Retrieval options outside the limits configured on the server"""
+
+
+@dataclass
+class Options:
+    mode: str
+    k: int
+    fetch_k: int
+    lambda_mult: float
+    score_threshold: Optional[float]
+    max_context_tokens: int
+    adaptive_drop: float
+
+
+def resolve_options(requested=None):
+    """Fill in defaults and enforce the server limits on `schemas.RetrievalOptions`"""
+    settings = Settings()
+    mode = getattr(requested, "mode", None) or "similarity"
+    default_k = settings.RETRIEVAL_ADAPTIVE_K if mode == "adaptive" else settings.RETRIEVAL_K
+    k = getattr(requested, "k", None) or default_k
+    fetch_k = getattr(requested, "fetch_k", None) or min(max(4 * k, 20), settings.RETRIEVAL_MAX_FETCH_K)
+    max_context_tokens = getattr(requested, "max_context_tokens", None) or settings.RETRIEVAL_MAX_CONTEXT_TOKENS
+    lambda_mult = getattr(requested, "lambda_mult", None)
+    adaptive_drop = getattr(requested, "adaptive_drop", None)
+
+    if k > settings.RETRIEVAL_MAX_K:
+        raise RetrievalLimitExceeded(f"k must be at most {settings.RETRIEVAL_MAX_K}")
+    if fetch_k > settings.RETRIEVAL_MAX_FETCH_K:
+        raise RetrievalLimitExceeded(f"fetch_k must be at most {settings.RETRIEVAL_MAX_FETCH_K}")
+    if max_context_tokens > settings.RETRIEVAL_MAX_CONTEXT_TOKENS:
+        raise RetrievalLimitExceeded(
+            f"max_context_tokens must be at most {settings.RETRIEVAL_MAX_CONTEXT_TOKENS}"
+        )
+
+    return Options(
+        mode=mode,
+        k=k,
+        fetch_k=max(fetch_k, k),
+        lambda_mult=0.5 if lambda_mult is None else lambda_mult,
+        score_threshold=getattr(requested, "score_threshold", None),
+        max_context_tokens=max_context_tokens,
+        adaptive_drop=settings.RETRIEVAL_ADAPTIVE_DROP if adaptive_drop is None else adaptive_drop,
+    )
+
+
+def similarity(distance):
+    # Embeddings are unit length and IndexFlatL2 returns squared L2 distances,
+    # so |a - b|^2 = 2 - 2 cos(a, b)
+    return 1.0 - float(distance) / 2.0
+
+
+def search(vectorstore, vector, options: Options):
+    """[(Document, score)] for one query embedding, best first, before filtering"""
+    if options.mode == "mmr":
+        results = vectorstore.max_marginal_relevance_search_with_score_by_vector(
+            vector, k=options.k, fetch_k=options.fetch_k, lambda_mult=options.lambda_mult
+        )
+    else:
+        results = vectorstore.similarity_search_with_score_by_vector(vector, k=options.k)
+    return [(doc, similarity(distance)) for doc, distance in results]
+
+
+def search_batch(vectorstore, vectors, options: Options):
+    """
+    `search` for many query embeddings with one FAISS search over the matrix
+    of queries. Each chunk is read from the docstore once, however many
+    queries retrieve it.
+    """
+    from langchain_community.vectorstores.utils import maximal_marginal_relevance
+
+    queries = np.asarray(vectors, dtype="float32")
+    k = options.fetch_k if options.mode == "mmr" else options.k
+    distances, ids = vectorstore.index.search(queries, k)
+
+    docs = {}
+
+    def document(i):
+        if i not in docs:
+            docs[i] = vectorstore.docstore.search(vectorstore.index_to_docstore_id[i])
+        return docs[i]
+
+    results = []
+    for query, row_distances, row_ids in zip(queries, distances, ids):
+        hits = [(int(i), d) for i, d in zip(row_ids, row_distances) if i >= 0]
+        if options.mode == "mmr" and hits:
+            hit_vectors = np.array([vectorstore.index.reconstruct(i) for i, _ in hits])
+            order = maximal_marginal_relevance(
+                query, hit_vectors, k=options.k, lambda_mult=options.lambda_mult
+            )
+            hits = [hits[j] for j in order]
+        results.append([(document(i), similarity(distance)) for i, distance in hits])
+    return results
+
+
+def select(candidates, options: Options):
+    """Apply the adaptive cut-off, score threshold and token budget to ranked (Document, score) candidates"""
+    if options.mode == "adaptive":
+        for i in range(1, len(candidates)):
+            if candidates[i - 1][1] - candidates[i][1] > options.adaptive_drop:
+                candidates = candidates[:i]
+                break
+
+    if options.score_threshold is not None:
+        candidates = [c for c in candidates if c[1] >= options.score_threshold]
+    if not candidates:
+        return []
+
+    token_counts = chunking.count_tokens(doc.page_content for doc, _ in candidates)
+    selected = []
+    used = 0
+    for candidate, tokens in zip(candidates, token_counts):
+        if selected and used + tokens > options.max_context_tokens:
+            break
+        selected.append(candidate)
+        used += tokens
+    return selected
+
+
+def sources(selected):
+    """Chunk ids, pages and scores of selected candidates, for AnswerResponse"""
+    return [
+        {"chunk": doc.metadata.get("chunk"), "page": doc.metadata.get("page"), "score": round(score, 4)}
+        for doc, score in selected
+    ]
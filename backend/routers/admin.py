@@ -0,0 +1,35 @@
+import secrets
+
+from fastapi import APIRouter, Header, HTTPException
+from fastapi.responses import PlainTextResponse
+
+import profiling
+from config import Settings
+
+router = APIRouter(prefix="/admin")
+
+
+def check_token(token):
+    expected = Settings().PROFILE_TOKEN
+    # Without a configured token the admin endpoints don't exist
+    if not expected:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not token or not secrets.compare_digest(token, expected):
+        raise HTTPException(status_code=403, detail="Invalid profile token")
+
+
+# Recent request profiles of all workers, newest first
+@router.get("/profiles")
+def list_profiles(x_profile_token: str = Header(default=None)):
+    check_token(x_profile_token)
+    return profiling.recent_profiles()
+
+
+# One profile as collapsed stacks, e.g. `curl ... | flamegraph.pl > profile.svg`
+@router.get("/profiles/{profile_id}", response_class=PlainTextResponse)
+def get_profile(profile_id: str, x_profile_token: str = Header(default=None)):
+    check_token(x_profile_token)
+    collapsed = profiling.get_profile(profile_id)
+    if collapsed is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return PlainTextResponse(collapsed)
@@ -1,9 +1,24 @@
+import asyncio
+import hashlib
+import json
 from typing import List
 from sqlalchemy.orm import Session
-from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File
+from urllib.parse import quote
+from botocore.exceptions import BotoCoreError, ClientError
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Query, Request, Response, status, UploadFile, File
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import RedirectResponse, StreamingResponse
 import schemas
 import crud
-from database import SessionLocal
+import summarize
+import page_text
+import index_store
+import search_index
+import retrieval
+import profiling
+from admission import embedding_calls, llm_calls
+from llm_cache import LLMCacheMiss, get_llm_cache
+from database import SessionLocal, session_scope
 from uuid import uuid4
 
 # Necessary imports for langchain summarization
@@ -36,19 +51,47 @@ def get_db():
     finally:
         db.close()
 
+def read_pdf_detached(id: int):
+    """Read a PDF row and release the DB connection before slow RAG work starts"""
+    with session_scope() as db:
+        return crud.read_pdf(db, id)
+
 @router.post("", response_model=schemas.PDFResponse, status_code=status.HTTP_201_CREATED)
-def create_pdf(pdf: schemas.PDFRequest, db: Session = Depends(get_db)):
-    return crud.create_pdf(db, pdf)
+def create_pdf(pdf: schemas.PDFRequest, background_tasks: BackgroundTasks, db: Session = Depends(get_db)):
+    db_pdf = crud.create_pdf(db, pdf)
+    # Background tasks run before get_db's teardown, so return the connection
+    # to the pool now rather than hold it through the text extraction.
+    # db_pdf was refreshed, so it stays usable detached.
+    db.close()
+    background_tasks.add_task(search_index.ensure_indexed, db_pdf)
+    return db_pdf
 
 @router.post("/upload", response_model=schemas.PDFResponse, status_code=status.HTTP_201_CREATED)
-def upload_pdf(file: UploadFile = File(...), db: Session = Depends(get_db)):
+def upload_pdf(background_tasks: BackgroundTasks, file: UploadFile = File(...), db: Session = Depends(get_db)):
     file_name = f"{uuid4()}-{file.filename}"
-    return crud.upload_pdf(db, file, file_name)
+    db_pdf = crud.upload_pdf(db, file, file_name)
+    # Extract the text for search (and the QA cache) after responding, without
+    # holding this request's connection (see create_pdf)
+    db.close()
+    background_tasks.add_task(search_index.ensure_indexed, db_pdf)
+    return db_pdf
 
 @router.get("", response_model=List[schemas.PDFResponse])
 def get_pdfs(selected: bool = None, db: Session = Depends(get_db)):
     return crud.read_pdfs(db, selected)
 
+@router.get("/search", response_model=schemas.SearchResponse)
+def search_pdfs(
+    q: str = Query(..., min_length=1, max_length=500),
+    page: int = Query(1, ge=1),
+    page_size: int = Query(20, ge=1, le=100),
+    selected: bool = None,
+    db: Session = Depends(get_db),
+):
+    """Full-text search over the text of all PDFs, best matching documents first"""
+    total, results = search_index.search(db, q, page, page_size, selected)
+    return {"query": q, "total": total, "page": page, "page_size": page_size, "results": results}
+
 @router.get("/{id}", response_model=schemas.PDFResponse)
 def get_pdf_by_id(id: int, db: Session = Depends(get_db)):
     pdf = crud.read_pdf(db, id)
@@ -62,23 +105,105 @@ def get_pdf_presigned_url(id: int, db: Session = Depends(get_db)):
     if pdf is None:
         raise HTTPException(status_code=404, detail="PDF not found")
     
-    presigned_url = crud.get_presigned_url(id, db)
+    presigned_url = crud.presign_pdf_url(pdf)
     if presigned_url is None:
         raise HTTPException(status_code=500, detail="Failed to generate presigned URL")
         
     return {"url": presigned_url}
 
+@router.get("/{id}/content")
+def get_pdf_content(id: int, request: Request, v: str = None):
+    """
+    Stream the PDF bytes with Range, ETag and Cache-Control support, so
+    browsers and CDNs can serve repeat views. Requests carrying the current
+    version as `v` are cacheable forever.
+    """
+    pdf = read_pdf_detached(id)
+    if pdf is None:
+        raise HTTPException(status_code=404, detail="PDF not found")
+    if crud.get_s3_key(pdf.file) is None:
+        # Not stored by us, let the client fetch it from its origin
+        return RedirectResponse(pdf.file)
+
+    version = crud.get_pdf_version(pdf)
+    etag = f'"{version}"'
+    if v == version:
+        cache_control = "public, max-age=31536000, immutable"
+    else:
+        cache_control = f"public, max-age={settings.PDF_CONTENT_MAX_AGE}"
+    headers = {"ETag": etag, "Cache-Control": cache_control, "Accept-Ranges": "bytes"}
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and etag in [tag.strip() for tag in if_none_match.split(",")]:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    byte_range = request.headers.get("range")
+    if byte_range and (not byte_range.startswith("bytes=") or "," in byte_range):
+        # Multiple ranges are not supported, send the whole file instead
+        byte_range = None
+    if_range = request.headers.get("if-range")
+    if byte_range and if_range and if_range != etag:
+        byte_range = None
+
+    try:
+        s3_object = crud.open_pdf_stream(pdf, byte_range)
+    except ClientError as e:
+        error = e.response.get("Error", {})
+        if error.get("Code") in ("NoSuchKey", "404"):
+            raise HTTPException(status_code=404, detail="PDF file not found in storage")
+        if error.get("Code") == "InvalidRange":
+            # S3 reports the size with the error; ask for it if it didn't
+            size = error.get("ActualObjectSize")
+            if size is None:
+                try:
+                    size = crud.get_pdf_size(pdf)
+                except (ClientError, BotoCoreError):
+                    pass
+            raise HTTPException(
+                status_code=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE,
+                detail="Invalid range",
+                headers={"Content-Range": f"bytes */{size}"} if size is not None else None,
+            )
+        print(f"Error reading PDF {id} from S3: {str(e)}")
+        raise HTTPException(status_code=500, detail="Failed to read PDF from storage")
+    except BotoCoreError as e:
+        print(f"Error connecting to S3 for PDF {id}: {str(e)}")
+        raise HTTPException(status_code=502, detail="Storage unavailable")
+
+    headers["Content-Length"] = str(s3_object["ContentLength"])
+    headers["Content-Disposition"] = f"inline; filename*=UTF-8''{quote(pdf.name or 'document.pdf')}"
+    status_code = status.HTTP_200_OK
+    if byte_range and s3_object.get("ContentRange"):
+        headers["Content-Range"] = s3_object["ContentRange"]
+        status_code = status.HTTP_206_PARTIAL_CONTENT
+
+    return StreamingResponse(
+        s3_object["Body"].iter_chunks(chunk_size=64 * 1024),
+        status_code=status_code,
+        media_type="application/pdf",
+        headers=headers,
+    )
+
 @router.put("/{id}", response_model=schemas.PDFResponse)
-def update_pdf(id: int, pdf: schemas.PDFRequest, db: Session = Depends(get_db)):
+def update_pdf(id: int, pdf: schemas.PDFRequest, background_tasks: BackgroundTasks, db: Session = Depends(get_db)):
+    existing = crud.read_pdf(db, id)
+    if existing is None:
+        raise HTTPException(status_code=404, detail="PDF not found")
+    old_version = crud.get_pdf_version(existing)
     updated_pdf = crud.update_pdf(db, id, pdf)
     if updated_pdf is None:
         raise HTTPException(status_code=404, detail="PDF not found")
+    if crud.get_pdf_version(updated_pdf) != old_version:
+        # A new file means a new version to index (see create_pdf for the close)
+        db.close()
+        background_tasks.add_task(search_index.ensure_indexed, updated_pdf)
     return updated_pdf
 
 @router.delete("/{id}", status_code=status.HTTP_200_OK)
 def delete_pdf(id: int, db: Session = Depends(get_db)):
     if not crud.delete_pdf(db, id):
         raise HTTPException(status_code=404, detail="PDF not found")
+    index_store.delete_for_pdf(id)
     return {"message": "PDF successfully deleted"}
 
 
@@ -86,40 +211,157 @@ def delete_pdf(id: int, db: Session = Depends(get_db)):
 from langchain_core.prompts import ChatPromptTemplate
 from operator import or_
 
-langchain_llm = OpenAI(temperature=0, openai_api_key=settings.OPENAI_API_KEY)
+# Temperature-0 completions are cached across requests and workers
+llm_cache = get_llm_cache()
+
+langchain_llm = OpenAI(temperature=0, openai_api_key=settings.OPENAI_API_KEY, cache=llm_cache)
 
 # Modern LangChain approach using | operator (RunnableSequence)
-summarize_template_string = """
-        Provide a summary for the following text:
-        {text}
-"""
+summarize_template_string = summarize.map_template_string
 
 summarize_prompt = ChatPromptTemplate.from_template(summarize_template_string)
 # Create a runnable sequence (prompt | llm | output parser)
 summarize_chain = summarize_prompt | langchain_llm | StrOutputParser()
 
+# Map-reduce summarizer for text longer than one model context
+summarizer = summarize.MapReduceSummarizer(
+    langchain_llm,
+    summarize.SummaryCache(settings.SUMMARY_CACHE_SIZE),
+    chunk_size=settings.SUMMARY_CHUNK_SIZE,
+    chunk_overlap=settings.SUMMARY_CHUNK_OVERLAP,
+    max_concurrency=settings.SUMMARY_MAX_CONCURRENCY,
+    fan_in=settings.SUMMARY_FAN_IN,
+)
+
+def cache_miss_error(e: LLMCacheMiss):
+    """503 for prompts with no cached completion while LLM_CACHE_MODE=replay"""
+    print(f"LLM cache miss in replay mode: {str(e)}")
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail=f"LLM calls are disabled (LLM_CACHE_MODE=replay) and the cache has no answer: {str(e)}",
+    )
+
 @router.post('/summarize-text')
 async def summarize_text(text: str):
-    # Use the modern invoke approach
-    summary = summarize_chain.invoke({"text": text})
-    return {'summary': summary}
+    try:
+        if len(text) <= settings.SUMMARY_CHUNK_SIZE:
+            # Short text fits in one call
+            async with llm_calls.ahold():
+                summary = await summarize_chain.ainvoke({"text": text})
+            return {'summary': summary}
+        result = await summarizer.summarize([text], ("text", hashlib.sha1(text.encode("utf-8")).hexdigest()))
+    except LLMCacheMiss as e:
+        raise cache_miss_error(e)
+    return {'summary': result["summary"]}
+
+
+def _load_pdf_pages(pdf):
+    """Load the page records of a stored PDF from the extracted page text cache"""
+    try:
+        pages = page_text.get_pages(pdf)
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"Error loading PDF text: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Download error: {str(e)}")
+    print(f"Loaded {len(pages)} pages from PDF")
+    return pages
+
+
+# Summarize a whole PDF file
+@router.post("/{id}/summarize", response_model=schemas.SummaryResponse, status_code=status.HTTP_200_OK)
+async def summarize_pdf_by_id(id: int, stream: bool = False):
+    """
+    Map-reduce summary of a stored PDF. With `stream=true` the response is
+    newline-delimited JSON progress events ending with a `summary` event.
+    """
+    pdf = await run_in_threadpool(read_pdf_detached, id)
+    if pdf is None:
+        raise HTTPException(status_code=404, detail="PDF not found")
+
+    namespace = ("pdf", id, crud.get_pdf_version(pdf))
+
+    async def load_pages():
+        pages = await run_in_threadpool(_load_pdf_pages, pdf)
+        return [page["normalized"] for page in pages]
+
+    if not stream:
+        try:
+            return await summarizer.summarize(await load_pages(), namespace)
+        except HTTPException:
+            raise
+        except LLMCacheMiss as e:
+            raise cache_miss_error(e)
+        except Exception as e:
+            print(f"Error summarizing PDF {id}: {str(e)}")
+            raise HTTPException(status_code=500, detail=f"Error summarizing PDF: {str(e)}")
+
+    async def event_stream():
+        queue = asyncio.Queue()
+
+        async def run():
+            try:
+                queue.put_nowait({"event": "loading"})
+                pages = await load_pages()
+                queue.put_nowait({"event": "loaded", "pages": len(pages)})
+                result = await summarizer.summarize(pages, namespace, progress=queue.put_nowait)
+                queue.put_nowait(dict(result, event="summary"))
+            except HTTPException as e:
+                queue.put_nowait({"event": "error", "detail": str(e.detail)})
+            except LLMCacheMiss as e:
+                queue.put_nowait({"event": "error", "detail": cache_miss_error(e).detail})
+            except Exception as e:
+                print(f"Error summarizing PDF {id}: {str(e)}")
+                queue.put_nowait({"event": "error", "detail": f"Error summarizing PDF: {str(e)}"})
+            finally:
+                queue.put_nowait(None)
+
+        task = asyncio.create_task(run())
+        try:
+            while True:
+                event = await queue.get()
+                if event is None:
+                    break
+                yield json.dumps(event) + "\n"
+        finally:
+            # Client went away: stop issuing LLM calls
+            task.cancel()
+
+    return StreamingResponse(event_stream(), media_type="application/x-ndjson")
 
 
 # Ask a question about one PDF file
+qa_prompt_template = """You are a helpful assistant that answers questions based on the provided document context.
+
+Context from the document:
+{context}
+
+Question: {question}
+
+Answer the question based only on the provided context. If you can't answer the question based on the context, say "I don't have enough information to answer this question based on the document."
+"""
+
+# Built once at import, so the production server can preload it before forking workers
+qa_prompt = ChatPromptTemplate.from_template(qa_prompt_template)
+
+qa_llm = OpenAI(
+    temperature=0,
+    openai_api_key=settings.OPENAI_API_KEY,
+    cache=llm_cache
+)
+
+qa_chain = qa_prompt | qa_llm
+
 @router.post("/qa-pdf/{id}", response_model=schemas.AnswerResponse, status_code=status.HTTP_200_OK)
-def qa_pdf_by_id(id: int, question_request: QuestionRequest, db: Session = Depends(get_db)):
+def qa_pdf_by_id(id: int, question_request: QuestionRequest):
     """
     Completely rewritten QA endpoint using the latest LangChain patterns
-    with progress visualization using tqdm
     """
-    import tempfile
-    import requests
-    import os
     import traceback
-    from tqdm import tqdm
     
-    # Get PDF from database
-    pdf = crud.read_pdf(db, id)
+    # Get PDF from database; the connection is released before the slow work
+    with profiling.stage("read_pdf"):
+        pdf = read_pdf_detached(id)
     if pdf is None:
         raise HTTPException(status_code=404, detail="PDF not found")
     
@@ -127,163 +369,59 @@ def qa_pdf_by_id(id: int, question_request: QuestionRequest, db: Session = Depen
     question = question_request.question
     if not question.strip():
         raise HTTPException(status_code=400, detail="Question cannot be empty")
+    try:
+        options = retrieval.resolve_options(question_request.retrieval)
+    except retrieval.RetrievalLimitExceeded as e:
+        raise HTTPException(status_code=400, detail=str(e))
     
     # Log what we're doing
     print(f"Processing QA for PDF ID {id}, question: {question}")
     print(f"PDF details: {pdf.name}, URL: {pdf.file}")
     
     try:
-        # Step 1: Generate presigned URL and download PDF to temporary file
-        try:
-            # Get presigned URL using existing function
-            presigned_url = crud.get_presigned_url(pdf_id=id, db=db)
-            if not presigned_url:
-                raise HTTPException(status_code=500, detail="Failed to generate presigned URL for PDF")
-                
-            print(f"Generated presigned URL for download")
-            
-            # Download using presigned URL with progress bar
-            with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as temp_file:
-                print(f"Downloading PDF using presigned URL")
-                
-                # Stream download with progress bar
-                response = requests.get(presigned_url, stream=True)
-                
-                if response.status_code != 200:
-                    print(f"Download failed with status code: {response.status_code}")
-                    raise HTTPException(status_code=500, detail=f"Failed to download PDF: HTTP {response.status_code}")
-                
-                # Get total file size for progress bar
-                total_size = int(response.headers.get('content-length', 0))
-                
-                # Download with progress bar
-                with tqdm(total=total_size, unit='B', unit_scale=True, desc="Downloading PDF") as pbar:
-                    for chunk in response.iter_content(chunk_size=1024):
-                        if chunk:
-                            temp_file.write(chunk)
-                            pbar.update(len(chunk))
-                
-                temp_file_path = temp_file.name
-                print(f"PDF downloaded to {temp_file_path}")
-        except Exception as download_error:
-            print(f"Error during download: {str(download_error)}")
-            raise HTTPException(status_code=500, detail=f"Download error: {str(download_error)}")
+        # Step 1 & 2: Load the PDF's vector index, building it from the cached page
+        # text on first use
+        print("Loading vector index")
+        with profiling.stage("load_index"):
+            vectorstore = index_store.get_index(pdf, lambda: _load_pdf_pages(pdf))
         
-        try:
-            # Step 2: Process PDF with simpler approach
-            # Import locally to avoid circular imports
-            from langchain_community.document_loaders import PyPDFLoader
-            from langchain_text_splitters import RecursiveCharacterTextSplitter
-            from langchain_openai import OpenAI, OpenAIEmbeddings
-            from langchain_community.vectorstores import FAISS
-            
-            # Load PDF
-            print("Loading PDF with PyPDFLoader")
-            loader = PyPDFLoader(temp_file_path)
-            docs = loader.load()
-            print(f"Loaded {len(docs)} pages from PDF")
-            
-            if not docs:
-                return {"answer": "The PDF appears to be empty or could not be processed."}
-            
-            # Process text with progress visualization
-            print("Splitting text into chunks")
-            text_splitter = RecursiveCharacterTextSplitter(
-                chunk_size=1000,  # Smaller chunks for better processing
-                chunk_overlap=200
-            )
-            
-            # Split documents with progress bar
-            chunks = []
-            for doc in tqdm(docs, desc="Processing PDF pages"):
-                chunks.extend(text_splitter.split_documents([doc]))
-            print(f"Split into {len(chunks)} chunks")
-            
-            # Create embeddings and vector store with progress visualization
-            print("Creating embeddings")
-            # Show a progress message since we can't track OpenAI API calls directly
-            print("Starting embeddings creation with OpenAI... (this may take a few moments)")
-            embeddings = OpenAIEmbeddings(openai_api_key=settings.OPENAI_API_KEY)
-            
-            # Handle the case where there are no chunks
-            if not chunks:
-                return {"answer": "The PDF could not be properly processed into searchable text."}
-            
-            # Create vector store with explicit FAISS import
-            import faiss
-            print("FAISS library loaded successfully")
-            vectorstore = FAISS.from_documents(chunks, embeddings)
-            
-            # Set up retriever
-            retriever = vectorstore.as_retriever(
-                search_type="similarity",
-                search_kwargs={"k": 3}  # Return top 3 most relevant chunks
-            )
-            
-            # Get context for our question using modern invoke approach
-            print("Retrieving relevant context")
-            context_docs = retriever.invoke(question)  # Use invoke instead of get_relevant_documents
-            
-            if not context_docs:
-                return {"answer": "I couldn't find relevant information in the document to answer your question."}
-            
-            # Extract text from context documents
-            context = "\n\n".join([doc.page_content for doc in context_docs])
-            
-            # Create prompt for QA
-            print("Creating prompt for QA")
-            from langchain.prompts import ChatPromptTemplate
-            
-            prompt_template = """You are a helpful assistant that answers questions based on the provided document context.
-            
-            Context from the document:
-            {context}
-            
-            Question: {question}
-            
-            Answer the question based only on the provided context. If you can't answer the question based on the context, say "I don't have enough information to answer this question based on the document."
-            """
-            
-            qa_prompt = ChatPromptTemplate.from_template(prompt_template)
-            
-            # Create LLM
-            print("Setting up LLM")
-            qa_llm = OpenAI(
-                temperature=0,
-                openai_api_key=settings.OPENAI_API_KEY
-            )
-            
-            # Create chain
-            qa_chain = qa_prompt | qa_llm
-            
-            # Run chain
-            print("Running QA chain")
+        # Handle the case where there are no chunks
+        if vectorstore is None:
+            return {"answer": "The PDF could not be properly processed into searchable text."}
+        
+        # Get context for our question with the requested search mode and limits
+        print(f"Retrieving relevant context ({options.mode}, k={options.k})")
+        with profiling.stage("embed_question"), embedding_calls.hold():
+            question_vector = vectorstore.embeddings.embed_query(question)
+        with profiling.stage("retrieve"):
+            context_docs = retrieval.select(retrieval.search(vectorstore, question_vector, options), options)
+        
+        if not context_docs:
+            return {"answer": "I couldn't find relevant information in the document to answer your question."}
+        
+        # Extract text from context documents
+        context = "\n\n".join([doc.page_content for doc, _ in context_docs])
+        
+        # Run chain
+        print("Running QA chain")
+        with profiling.stage("llm"), llm_calls.hold():
             response = qa_chain.invoke({
                 "context": context,
                 "question": question
             })
+        
+        # Get answer - handle both string and object responses
+        if hasattr(response, 'content'):
+            answer = response.content
+        else:
+            # If response is a string, use it directly
+            answer = str(response)
             
-            # Get answer - handle both string and object responses
-            if hasattr(response, 'content'):
-                answer = response.content
-            else:
-                # If response is a string, use it directly
-                answer = str(response)
-                
-            print(f"Generated answer: {answer[:100]}...")
-            
-            # Format response to match schema
-            return schemas.AnswerResponse(answer=answer)
-            
-        finally:
-            # Clean up temporary file
-            try:
-                if 'temp_file_path' in locals() and temp_file_path and os.path.exists(temp_file_path):
-                    os.unlink(temp_file_path)
-                    print(f"Deleted temporary file {temp_file_path}")
-            except Exception as cleanup_error:
-                print(f"Error cleaning up temp file: {str(cleanup_error)}")
-            
+        print(f"Generated answer: {answer[:100]}...")
+        
+        # Format response to match schema
+        return schemas.AnswerResponse(answer=answer, sources=retrieval.sources(context_docs))
+        
     except HTTPException as http_exc:
         # Re-raise HTTP exceptions directly
         raise http_exc
@@ -309,3 +447,119 @@ def qa_pdf_by_id(id: int, question_request: QuestionRequest, db: Session = Depen
             detail = f"Error processing PDF: {error_message}"
             
         raise HTTPException(status_code=500, detail=detail)
+
+
+NO_CONTEXT_ANSWER = "I couldn't find relevant information in the document to answer your question."
+
+
+# Ask many questions about one PDF file
+@router.post("/{id}/qa-batch", response_model=schemas.BatchAnswerResponse, status_code=status.HTTP_200_OK)
+async def qa_batch_by_id(id: int, batch_request: schemas.BatchQuestionRequest, stream: bool = False):
+    """
+    Answer several questions about one PDF. The questions are embedded in one
+    call and searched in one FAISS search; questions with the same context are
+    answered once, and the LLM calls run concurrently. With `stream=true` the
+    response is newline-delimited JSON, one `answer` event per question as it
+    finishes, then a `done` event.
+    """
+    questions = batch_request.questions
+    if len(questions) > settings.QA_BATCH_MAX_QUESTIONS:
+        raise HTTPException(status_code=400, detail=f"At most {settings.QA_BATCH_MAX_QUESTIONS} questions per batch")
+    if any(not question.strip() for question in questions):
+        raise HTTPException(status_code=400, detail="Question cannot be empty")
+    try:
+        options = retrieval.resolve_options(batch_request.retrieval)
+    except retrieval.RetrievalLimitExceeded as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    pdf = await run_in_threadpool(read_pdf_detached, id)
+    if pdf is None:
+        raise HTTPException(status_code=404, detail="PDF not found")
+    print(f"Processing batch QA for PDF ID {id}, {len(questions)} questions")
+    profiling.tag(questions=len(questions))
+
+    def retrieve():
+        with profiling.stage("load_index"):
+            vectorstore = index_store.get_index(pdf, lambda: _load_pdf_pages(pdf))
+        if vectorstore is None:
+            return None
+        with profiling.stage("embed_questions"), embedding_calls.hold():
+            vectors = vectorstore.embeddings.embed_documents(questions)
+        with profiling.stage("retrieve"):
+            return [
+                retrieval.select(candidates, options)
+                for candidates in retrieval.search_batch(vectorstore, vectors, options)
+            ]
+
+    try:
+        contexts = await run_in_threadpool(retrieve)
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"Error retrieving context for PDF {id}: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error processing PDF: {str(e)}")
+    if contexts is None:
+        raise HTTPException(status_code=422, detail="The PDF could not be properly processed into searchable text.")
+
+    # Questions asked twice with the same context share one LLM call
+    calls = {}
+    for i, (question, selected) in enumerate(zip(questions, contexts)):
+        if selected:
+            key = (question.strip(), tuple(doc.metadata.get("chunk") for doc, _ in selected))
+            calls.setdefault(key, []).append(i)
+    print(f"Retrieved context for {len(questions)} questions, {len(calls)} distinct LLM calls")
+
+    semaphore = asyncio.Semaphore(settings.QA_BATCH_MAX_CONCURRENCY)
+
+    async def answer(indexes):
+        selected = contexts[indexes[0]]
+        async with semaphore, llm_calls.ahold():
+            response = await qa_chain.ainvoke({
+                "context": "\n\n".join(doc.page_content for doc, _ in selected),
+                "question": questions[indexes[0]],
+            })
+        text = response.content if hasattr(response, "content") else str(response)
+        return [
+            {"index": i, "question": questions[i], "answer": text, "sources": retrieval.sources(selected)}
+            for i in indexes
+        ]
+
+    unanswerable = [
+        {"index": i, "question": questions[i], "answer": NO_CONTEXT_ANSWER, "sources": []}
+        for i, selected in enumerate(contexts)
+        if not selected
+    ]
+    tasks = [asyncio.ensure_future(answer(indexes)) for indexes in calls.values()]
+
+    if not stream:
+        try:
+            with profiling.stage("llm"):
+                results = await asyncio.gather(*tasks)
+        except Exception as e:
+            for task in tasks:
+                task.cancel()
+            print(f"Error in batch QA for PDF {id}: {str(e)}")
+            raise HTTPException(status_code=500, detail=f"Error processing PDF: {str(e)}")
+        answers = unanswerable + [item for result in results for item in result]
+        return {"answers": sorted(answers, key=lambda item: item["index"])}
+
+    async def event_stream():
+        try:
+            for item in unanswerable:
+                yield json.dumps(dict(item, event="answer")) + "\n"
+            for next_done in asyncio.as_completed(tasks):
+                try:
+                    result = await next_done
+                except Exception as e:
+                    print(f"Error in batch QA for PDF {id}: {str(e)}")
+                    yield json.dumps({"event": "error", "detail": f"Error processing PDF: {str(e)}"}) + "\n"
+                    continue
+                for item in result:
+                    yield json.dumps(dict(item, event="answer")) + "\n"
+            yield json.dumps({"event": "done", "questions": len(questions)}) + "\n"
+        finally:
+            # Client went away: stop issuing LLM calls
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(event_stream(), media_type="application/x-ndjson")
@@ -1,23 +1,103 @@
-from pydantic import BaseModel
-from typing import Optional
+import hashlib
+from pydantic import BaseModel, Field, computed_field, model_validator
+from typing import List, Optional, Literal
+
+ChunkStrategy = Literal["recursive", "token", "sentence", "page_spanning"]
+
+def content_version(file: Optional[str]) -> str:
+    """Short content version of a PDF; every upload gets a new file URL, so hash that"""
+    return hashlib.sha1((file or "").encode("utf-8")).hexdigest()[:12]
 
 class PDFRequest(BaseModel):
     name: str
     selected: bool
     file: str
+    chunk_strategy: Optional[ChunkStrategy] = None
+    chunk_size: Optional[int] = Field(default=None, gt=0)
+    chunk_overlap: Optional[int] = Field(default=None, ge=0)
+
+    @model_validator(mode="after")
+    def check_overlap(self):
+        if self.chunk_size is not None and self.chunk_overlap is not None and self.chunk_overlap >= self.chunk_size:
+            raise ValueError("chunk_overlap must be smaller than chunk_size")
+        return self
 
 class PDFResponse(BaseModel):
     id: int
     name: str
     selected: bool
     file: str
+    chunk_strategy: Optional[str] = None
+    chunk_size: Optional[int] = None
+    chunk_overlap: Optional[int] = None
+
+    # Passed as `v` to GET /pdfs/{id}/content so the response can be cached forever
+    @computed_field
+    @property
+    def version(self) -> str:
+        return content_version(self.file)
 
     class Config:
         from_attributes = True
 
 #For PDF QA    
+class RetrievalOptions(BaseModel):
+    mode: Literal["similarity", "mmr", "adaptive"] = "similarity"
+    k: Optional[int] = Field(default=None, ge=1)
+    fetch_k: Optional[int] = Field(default=None, ge=1)
+    lambda_mult: Optional[float] = Field(default=None, ge=0, le=1)
+    score_threshold: Optional[float] = Field(default=None, ge=-1, le=1)
+    max_context_tokens: Optional[int] = Field(default=None, ge=1)
+    adaptive_drop: Optional[float] = Field(default=None, gt=0, le=2)
+
 class QuestionRequest(BaseModel):
     question: str
-    
+    retrieval: Optional[RetrievalOptions] = None
+
+class SourceChunk(BaseModel):
+    chunk: Optional[int] = None
+    page: Optional[int] = None
+    score: float
+
 class AnswerResponse(BaseModel):
     answer: str
+    sources: List[SourceChunk] = []
+
+class BatchQuestionRequest(BaseModel):
+    questions: List[str] = Field(min_length=1)
+    retrieval: Optional[RetrievalOptions] = None
+
+class BatchAnswer(BaseModel):
+    index: int
+    question: str
+    answer: str
+    sources: List[SourceChunk] = []
+
+class BatchAnswerResponse(BaseModel):
+    answers: List[BatchAnswer]
+
+#For PDF summarization
+class SummaryResponse(BaseModel):
+    summary: str
+    chunks: int
+    levels: int
+    cached: bool
+
+#For full-text search
+class SearchPage(BaseModel):
+    page: int
+    snippet: str
+
+class SearchResult(BaseModel):
+    id: int
+    name: str
+    score: float
+    matches: int
+    pages: List[SearchPage]
+
+class SearchResponse(BaseModel):
+    query: str
+    total: int
+    page: int
+    page_size: int
+    results: List[SearchResult]
@@ -0,0 +1,167 @@
+"""
+Full-text search over the extracted page text of all PDFs.
+
+Pages are stored in the `pdf_pages` table, whose generated `tsv` column has
+a GIN index. Rows are written once per PDF version, normally from a
+background task after upload. To index PDFs uploaded before search existed:
+
+    python search_index.py --backfill
+"""
+import argparse
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+import crud
+import models
+import page_text
+from database import session_scope
+
+HEADLINE_OPTIONS = "StartSel=<mark>, StopSel=</mark>, MaxFragments=2, MaxWords=30, MinWords=10"
+
+SEARCH_SQL = text("""
+    WITH q AS (
+        SELECT websearch_to_tsquery('english', :q) AS query
+    ),
+    -- Matching pages are ranked and numbered without their text, which is
+    -- only read back for the few pages that get a snippet
+    matched AS (
+        SELECT p.id, p.pdf_id, p.page, ts_rank_cd(p.tsv, q.query) AS rank
+        FROM pdf_pages p
+        JOIN pdfs f ON f.id = p.pdf_id
+        CROSS JOIN q
+        WHERE p.tsv @@ q.query
+          AND (CAST(:selected AS boolean) IS NULL OR f.selected = :selected)
+    ),
+    -- Rank pages within each PDF in the same pass, so picking the best pages
+    -- of the result documents doesn't rescan the matches per document
+    hits AS (
+        SELECT id, pdf_id, page, rank,
+               row_number() OVER (PARTITION BY pdf_id ORDER BY rank DESC, page) AS rn
+        FROM matched
+    ),
+    docs AS (
+        SELECT pdf_id, sum(rank) AS score, count(*) AS matches, count(*) OVER () AS total
+        FROM hits
+        GROUP BY pdf_id
+        ORDER BY score DESC, pdf_id
+        LIMIT :limit OFFSET :offset
+    )
+    SELECT d.pdf_id, f.name, d.score, d.matches, d.total, h.page,
+           ts_headline('english', p.content, q.query, :headline) AS snippet
+    FROM docs d
+    JOIN pdfs f ON f.id = d.pdf_id
+    JOIN hits h ON h.pdf_id = d.pdf_id AND h.rn <= :pages_per_doc
+    JOIN pdf_pages p ON p.id = h.id
+    CROSS JOIN q
+    ORDER BY d.score DESC, d.pdf_id, h.rn
+""")
+
+COUNT_SQL = text("""
+    SELECT count(DISTINCT p.pdf_id)
+    FROM pdf_pages p
+    JOIN pdfs f ON f.id = p.pdf_id
+    WHERE p.tsv @@ websearch_to_tsquery('english', :q)
+      AND (CAST(:selected AS boolean) IS NULL OR f.selected = :selected)
+""")
+
+
+def is_indexed(db: Session, pdf_id: int, version: str):
+    return db.query(models.PDFPage.id).filter(
+        models.PDFPage.pdf_id == pdf_id, models.PDFPage.version == version
+    ).first() is not None
+
+
+def index_pages(db: Session, pdf_id: int, version: str, pages):
+    """
+    Replace the indexed pages of a PDF, unless this version is already
+    indexed. Overlapping indexing tasks for one PDF (an upload followed by an
+    update, a backfill) take turns on a transaction-scoped advisory lock, so
+    they never both insert. Returns whether the pages were written.
+    """
+    db.execute(text("SELECT pg_advisory_xact_lock(:pdf_id)"), {"pdf_id": pdf_id})
+    if is_indexed(db, pdf_id, version):
+        db.rollback()
+        return False
+    db.query(models.PDFPage).filter(models.PDFPage.pdf_id == pdf_id).delete(synchronize_session=False)
+    db.bulk_insert_mappings(models.PDFPage, [
+        {"pdf_id": pdf_id, "version": version, "page": page["page"], "content": page["normalized"]}
+        for page in pages
+        if page["normalized"]
+    ])
+    db.commit()
+    return True
+
+
+def ensure_indexed(pdf):
+    """
+    Index a PDF's pages if its current version isn't indexed yet. Also warms
+    the page text cache, so the first QA request doesn't have to parse the PDF.
+    """
+    version = crud.get_pdf_version(pdf)
+    with session_scope() as db:
+        if is_indexed(db, pdf.id, version):
+            return
+    try:
+        pages = page_text.get_pages(pdf)
+    except Exception as e:
+        print(f"Error extracting text of PDF {pdf.id} for search: {str(e)}")
+        return
+    with session_scope() as db:
+        if not index_pages(db, pdf.id, version, pages):
+            return
+    print(f"Indexed {len(pages)} pages of PDF {pdf.id} for search")
+
+
+def search(db: Session, q: str, page: int = 1, page_size: int = 20, selected: bool = None,
+           pages_per_doc: int = 3):
+    """
+    Ranked documents matching a web-style query (quotes, OR, -term), with the
+    best matching pages and highlighted snippets of each.
+    Returns (total matching documents, results).
+    """
+    rows = db.execute(SEARCH_SQL, {
+        "q": q,
+        "selected": selected,
+        "limit": page_size,
+        "offset": (page - 1) * page_size,
+        "pages_per_doc": pages_per_doc,
+        "headline": HEADLINE_OPTIONS,
+    }).all()
+
+    total = 0
+    results = {}
+    for row in rows:
+        total = row.total
+        result = results.get(row.pdf_id)
+        if result is None:
+            result = results[row.pdf_id] = {
+                "id": row.pdf_id,
+                "name": row.name,
+                "score": float(row.score),
+                "matches": row.matches,
+                "pages": [],
+            }
+        result["pages"].append({"page": row.page, "snippet": row.snippet})
+    if not rows and page > 1:
+        # Past the last page the main query can't report the total
+        total = db.execute(COUNT_SQL, {"q": q, "selected": selected}).scalar()
+    return total, list(results.values())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Full-text search index maintenance")
+    parser.add_argument("--backfill", action="store_true", help="Index every PDF not indexed yet")
+    args = parser.parse_args()
+    if not args.backfill:
+        parser.print_help()
+        return
+
+    with session_scope() as db:
+        pdfs = crud.read_pdfs(db)
+    for pdf in pdfs:
+        ensure_indexed(pdf)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+# server.py
+"""
+Production server for main:app: gunicorn managing uvicorn workers.
+
+    python server.py                      # one worker per CPU core on 0.0.0.0:8000
+    python server.py --workers 4 --bind 0.0.0.0:8080
+
+The app, settings, prompt templates and the most recently used FAISS indexes
+are loaded once in the master process and inherited by the forked workers
+(copy-on-write, and indexes are memory-mapped). Send SIGHUP to the master to
+reload indexes: the master reloads them, starts fresh workers and lets the old
+ones finish their in-flight requests before exiting.
+
+Environment variables: WEB_CONCURRENCY (workers), BIND, WORKER_TIMEOUT,
+GRACEFUL_TIMEOUT, KEEPALIVE, MAX_REQUESTS and PROMETHEUS_MULTIPROC_DIR. The
+database connection budget (DB_MAX_CONNECTIONS) is split across the workers.
+"""
+import argparse
+import gc
+import multiprocessing
+import os
+import shutil
+import tempfile
+
+from gunicorn.app.base import BaseApplication
+from uvicorn.workers import UvicornWorker
+
+
+class TunedUvicornWorker(UvicornWorker):
+    """Uvicorn worker pinned to the uvloop event loop and the httptools parser"""
+
+    CONFIG_KWARGS = {"loop": "uvloop", "http": "httptools", "lifespan": "on"}
+
+
+def default_workers():
+    # Endpoints are I/O bound (S3, Postgres, OpenAI) and each worker already
+    # runs blocking work in a thread pool, so one worker per core is enough
+    return int(os.environ.get("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+
+
+def gunicorn_options(workers=None, bind=None):
+    return {
+        "bind": bind or os.environ.get("BIND", "0.0.0.0:8000"),
+        "workers": workers or default_workers(),
+        "worker_class": "server.TunedUvicornWorker",
+        "preload_app": True,
+        # QA and summarization wait on the LLM for a long time
+        "timeout": int(os.environ.get("WORKER_TIMEOUT", 180)),
+        "graceful_timeout": int(os.environ.get("GRACEFUL_TIMEOUT", 60)),
+        "keepalive": int(os.environ.get("KEEPALIVE", 5)),
+        # Recycle workers now and then to bound memory growth
+        "max_requests": int(os.environ.get("MAX_REQUESTS", 2000)),
+        "max_requests_jitter": 200,
+        "pre_fork": pre_fork,
+        "post_fork": post_fork,
+        "on_reload": on_reload,
+        "child_exit": child_exit,
+    }
+
+
+def pre_fork(server, worker):
+    # Move everything loaded so far out of the garbage collector's reach, so
+    # collections in the workers don't touch (and copy) the shared pages
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    server.log.info(f"Worker {worker.pid} started")
+
+
+def on_reload(server):
+    import index_store
+    server.log.info("Reloading indexes before restarting workers")
+    index_store.preload()
+
+
+def child_exit(server, worker):
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
+
+
+class Application(BaseApplication):
+    def __init__(self, options):
+        self.options = options
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        # Runs once in the master because of preload_app
+        import database
+        database.check_connection_budget(self.options["workers"])
+        from main import app
+        import index_store
+        index_store.preload()
+        return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the production server")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--bind", default=None)
+    args = parser.parse_args()
+
+    # Metrics from every worker are aggregated through files in this directory
+    if not os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        os.environ["PROMETHEUS_MULTIPROC_DIR"] = tempfile.mkdtemp(prefix="prometheus-")
+    else:
+        shutil.rmtree(os.environ["PROMETHEUS_MULTIPROC_DIR"], ignore_errors=True)
+        os.makedirs(os.environ["PROMETHEUS_MULTIPROC_DIR"])
+
+    options = gunicorn_options(args.workers, args.bind)
+    # database.py sizes each worker's connection pool from this
+    os.environ["WEB_CONCURRENCY"] = str(options["workers"])
+    Application(options).run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+import asyncio
+import hashlib
+from collections import OrderedDict
+from threading import Lock
+
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.prompts import ChatPromptTemplate
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from admission import llm_calls
+
+# Prompt used for each chunk (map step)
+map_template_string = """
+        Provide a summary for the following text:
+        {text}
+"""
+
+# Prompt used to merge neighbouring summaries (reduce step)
+reduce_template_string = """
+        The following are summaries of consecutive parts of the same document.
+        Combine them into a single coherent summary that keeps the key points:
+        {text}
+"""
+
+# Identifies the prompt pair in cache keys, so editing a template invalidates old summaries
+PROMPT_KEY = hashlib.sha1(
+    (map_template_string + reduce_template_string).encode("utf-8")
+).hexdigest()[:12]
+
+
+def _text_hash(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+class SummaryCache:
+    """Thread-safe in-process LRU cache for intermediate and final summaries"""
+
+    def __init__(self, max_entries: int = 2048):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+class MapReduceSummarizer:
+    """
+    Summarizes arbitrarily long text by summarizing chunks concurrently (map)
+    and then merging groups of `fan_in` neighbouring summaries until one is left
+    (reduce). Every round runs in parallel, so latency grows with
+    log_fan_in(chunks) rather than with the number of chunks.
+    """
+
+    def __init__(self, llm, cache: SummaryCache, chunk_size: int = 4000, chunk_overlap: int = 200,
+                 max_concurrency: int = 8, fan_in: int = 4):
+        self.map_chain = ChatPromptTemplate.from_template(map_template_string) | llm | StrOutputParser()
+        self.reduce_chain = ChatPromptTemplate.from_template(reduce_template_string) | llm | StrOutputParser()
+        self.cache = cache
+        self.splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+        self.max_concurrency = max_concurrency
+        self.fan_in = max(2, fan_in)
+        # Settings that shape the final summary, part of its cache key so
+        # changing them doesn't serve summaries made with the old ones
+        self.settings_key = (chunk_size, chunk_overlap, self.fan_in, max_concurrency)
+
+    def split(self, texts):
+        """Split page texts into map-step chunks"""
+        return self.splitter.split_text("\n\n".join(t for t in texts if t and t.strip()))
+
+    async def summarize(self, texts, namespace: tuple, progress=None):
+        """
+        Summarize a list of texts (e.g. PDF pages).
+
+        `namespace` scopes the cache entries, e.g. ("pdf", pdf_id, version).
+        `progress`, if given, is called with a dict for every finished step.
+        Returns a dict with the summary, number of chunks and reduce levels.
+        """
+        def report(event):
+            if progress is not None:
+                progress(event)
+
+        final_key = namespace + (PROMPT_KEY, self.settings_key, "final")
+        cached = self.cache.get(final_key)
+        if cached is not None:
+            report({"event": "cached"})
+            return dict(cached, cached=True)
+
+        chunks = self.split(texts)
+        if not chunks:
+            return {"summary": "", "chunks": 0, "levels": 0, "cached": False}
+
+        # One semaphore per call bounds this request's fan-out to the LLM;
+        # llm_calls bounds the LLM calls of all requests together
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def run_step(chain, level, text):
+            key = namespace + (PROMPT_KEY, level, _text_hash(text))
+            summary = self.cache.get(key)
+            if summary is None:
+                async with semaphore, llm_calls.ahold():
+                    summary = await chain.ainvoke({"text": text})
+                self.cache.set(key, summary)
+            return summary
+
+        async def run_level(chain, level, inputs):
+            total = len(inputs)
+            done = 0
+            report({"event": "level_started", "level": level, "total": total})
+
+            async def tracked(text):
+                nonlocal done
+                summary = await run_step(chain, level, text)
+                done += 1
+                report({"event": "progress", "level": level, "done": done, "total": total})
+                return summary
+
+            return await asyncio.gather(*(tracked(text) for text in inputs))
+
+        summaries = await run_level(self.map_chain, 0, chunks)
+        level = 0
+        while len(summaries) > 1:
+            level += 1
+            groups = [summaries[i:i + self.fan_in] for i in range(0, len(summaries), self.fan_in)]
+            # A trailing single summary is carried over to the next level as is
+            merged = iter(await run_level(
+                self.reduce_chain, level, ["\n\n".join(g) for g in groups if len(g) > 1]
+            ))
+            summaries = [next(merged) if len(g) > 1 else g[0] for g in groups]
+
+        result = {"summary": summaries[0].strip(), "chunks": len(chunks), "levels": level}
+        self.cache.set(final_key, result)
+        return dict(result, cached=False)
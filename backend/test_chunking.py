@@ -0,0 +1,127 @@
+from types import SimpleNamespace
+
+import pytest
+
+import chunking
+
+REQUIRED_SETTINGS = (
+    "DATABASE_HOST", "DATABASE_NAME", "DATABASE_USER", "DATABASE_PASSWORD",
+    "AWS_KEY", "AWS_SECRET", "AWS_S3_BUCKET", "OPENAI_API_KEY",
+)
+
+
+@pytest.fixture
+def settings(monkeypatch):
+    for name in REQUIRED_SETTINGS:
+        monkeypatch.setenv(name, "x")
+    monkeypatch.setenv("DATABASE_PORT", "5432")
+    monkeypatch.setenv("CHUNK_STRATEGY", "recursive")
+    monkeypatch.setenv("CHUNK_SIZE", "1000")
+    monkeypatch.setenv("CHUNK_OVERLAP", "200")
+
+
+class WordEncoding:
+    """Stand-in for the tiktoken encoding with one token per word"""
+
+    def encode_ordinary_batch(self, texts):
+        return [text.split() for text in texts]
+
+    def decode_batch(self, windows):
+        return [" ".join(window) for window in windows]
+
+
+def pages(*texts):
+    """Page records as returned by page_text.get_pages"""
+    records = []
+    offset = 0
+    for number, text in enumerate(texts):
+        normalized = " ".join(text.split())
+        records.append({"page": number, "offset": offset, "text": text, "normalized": normalized})
+        offset += len(normalized) + 1
+    return records
+
+
+def test_config_for_uses_global_settings(settings):
+    assert chunking.config_for() == ("recursive", 1000, 200)
+
+
+def test_config_for_scales_overlap_with_overridden_size(settings):
+    pdf = SimpleNamespace(chunk_strategy="token", chunk_size=150, chunk_overlap=None)
+    assert chunking.config_for(pdf) == ("token", 150, 30)
+
+
+def test_config_for_keeps_explicit_overlap_below_size(settings):
+    assert chunking.config_for(SimpleNamespace(chunk_size=150, chunk_overlap=0))[2] == 0
+    assert chunking.config_for(SimpleNamespace(chunk_size=None, chunk_overlap=5000))[2] == 999
+
+
+def test_recursive_splits_each_page_separately():
+    chunks = chunking.split_recursive(pages("a " * 30, "b " * 5), chunk_size=20, chunk_overlap=0)
+    assert {page for page, _ in chunks} == {0, 1}
+    assert all(len(text) <= 20 for _, text in chunks)
+    assert [text for page, text in chunks if page == 1] == ["b b b b b"]
+
+
+def test_token_windows_overlap(monkeypatch):
+    monkeypatch.setattr(chunking, "get_encoding", WordEncoding)
+    words = " ".join(f"w{i}" for i in range(10))
+    chunks = chunking.split_token(pages(words, "x y"), chunk_size=4, chunk_overlap=1)
+    assert chunks == [
+        (0, "w0 w1 w2 w3"),
+        (0, "w3 w4 w5 w6"),
+        (0, "w6 w7 w8 w9"),
+        (1, "x y"),
+    ]
+
+
+def test_sentence_chunks_pack_sentences_and_carry_overlap():
+    text = "One is here. Two is here. Three is here. Four is here."
+    chunks = chunking.split_sentence(pages(text), chunk_size=30, chunk_overlap=15)
+    assert chunks == [
+        (0, "One is here. Two is here."),
+        (0, "Two is here. Three is here."),
+        (0, "Three is here. Four is here."),
+    ]
+
+
+def test_sentence_chunks_start_at_headings():
+    text = "Intro text. More intro.\n2.1 Results\nWe found things.\nMETHODS\nWe did things."
+    chunks = chunking.split_sentence(pages(text), chunk_size=1000, chunk_overlap=100)
+    assert [text for _, text in chunks] == [
+        "Intro text. More intro.",
+        "2.1 Results We found things.",
+        "METHODS We did things.",
+    ]
+
+
+@pytest.mark.parametrize("line", ["2.1 Results", "3. Methods", "4.2.1 Data Sources", "INTRODUCTION"])
+def test_heading_pattern_matches_section_titles(line):
+    assert chunking._HEADING.match(line)
+
+
+@pytest.mark.parametrize("line", [
+    "2019 saw a large increase in sales.",
+    "1. Mix the flour, then add water.",
+    "3.5 4.2 7.1 9.9",
+    "12 apples 30 pears",
+    "1.2 Results were better than expected.",
+])
+def test_heading_pattern_ignores_numbered_text(line):
+    assert not chunking._HEADING.match(line)
+
+
+def test_page_spanning_chunks_keep_their_start_page():
+    chunks = chunking.split_page_spanning(
+        pages("one two three four", "five six seven eight"), chunk_size=12, chunk_overlap=0
+    )
+    assert chunks == [(0, "one two"), (0, "three four"), (1, "five six"), (1, "seven eight")]
+
+
+def test_split_pages_numbers_chunks_and_rejects_unknown_strategies():
+    docs = chunking.split_pages(pages("a b c", "d e f"), "recursive", 3, 0, source="doc.pdf")
+    assert [(doc.page_content, doc.metadata["page"], doc.metadata["chunk"]) for doc in docs] == [
+        ("a b", 0, 0), ("c", 0, 1), ("d e", 1, 2), ("f", 1, 3),
+    ]
+    assert docs[0].metadata["source"] == "doc.pdf"
+    with pytest.raises(ValueError):
+        chunking.split_pages(pages("a"), "words", 3, 0)
@@ -0,0 +1,252 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import reconcile
+
+SUFFIX = ".pages.jsonl.gz"
+NOW = datetime(2026, 1, 1, tzinfo=timezone.utc)
+OLD = NOW - timedelta(days=1)
+CUTOFF = NOW - timedelta(hours=1)
+
+
+def sidecar_key(key):
+    return key + SUFFIX
+
+
+class FakeS3:
+    """Records delete_objects calls; keys in `fail` come back as errors"""
+
+    def __init__(self, fail=()):
+        self.calls = []
+        self.fail = set(fail)
+
+    def delete_objects(self, Bucket, Delete):
+        keys = [obj["Key"] for obj in Delete["Objects"]]
+        self.calls.append(keys)
+        return {"Errors": [{"Key": key, "Message": "denied"} for key in keys if key in self.fail]}
+
+
+def rows(*keys):
+    """pdfs table rows (id, file, key) in key order"""
+    return [(i, f"https://bucket.s3.amazonaws.com/{key}", key) for i, key in enumerate(keys, 1)]
+
+
+def objects(*keys, modified=OLD, size=10):
+    return [(key, size, modified) for key in keys]
+
+
+def expected(*keys):
+    table = rows(*keys)
+    # The second cursor is ordered by sidecar key
+    return reconcile.expected_keys(table, sorted(table, key=lambda row: sidecar_key(row[2])), sidecar_key)
+
+
+def run(expected_items, actual_items, dry_run=False, rebuild=None, fail=()):
+    s3 = FakeS3(fail)
+    deleter = reconcile.Deleter(s3, "bucket", dry_run)
+    stats = reconcile.diff_objects(expected_items, actual_items, deleter, CUTOFF, rebuild)
+    return stats, s3
+
+
+def test_merge_interleaves_keys():
+    merged = list(reconcile.merge([("a",), ("c",), ("e",)], [("b",), ("c",), ("d",)]))
+    assert [(key, l is not None, r is not None) for key, l, r in merged] == [
+        ("a", True, False),
+        ("b", False, True),
+        ("c", True, True),
+        ("d", False, True),
+        ("e", True, False),
+    ]
+
+
+def test_orphans_between_known_keys_are_deleted():
+    actual = objects("a.pdf", "a.pdf" + SUFFIX, "b-orphan.pdf", "c.pdf", "c.pdf" + SUFFIX, "z-orphan.pdf")
+    stats, s3 = run(expected("a.pdf", "c.pdf"), actual)
+    assert s3.calls == [["b-orphan.pdf", "z-orphan.pdf"]]
+    assert stats["orphans"] == 2
+    assert stats["orphan_bytes"] == 20
+    assert stats["objects"] == 6
+    assert stats["missing_pdfs"] == stats["missing_sidecars"] == 0
+
+
+def test_sidecar_is_matched_to_its_pdf_when_other_keys_sort_between():
+    # "a.pdf-2.pdf" sorts between "a.pdf" and its sidecar "a.pdf.pages.jsonl.gz"
+    keys = ["a.pdf", "a.pdf-2.pdf"]
+    items = list(expected(*keys))
+    # ...and "a.pdf-2.pdf"'s sidecar sorts before "a.pdf"'s
+    assert [item[0] for item in items] == ["a.pdf", "a.pdf-2.pdf", "a.pdf-2.pdf" + SUFFIX, "a.pdf" + SUFFIX]
+    assert [item[1] for item in items] == [reconcile.PDF, reconcile.PDF, reconcile.SIDECAR, reconcile.SIDECAR]
+
+    actual = objects("a.pdf", "a.pdf-2.pdf", "a.pdf-2.pdf" + SUFFIX, "a.pdf" + SUFFIX)
+    stats, s3 = run(expected(*keys), actual)
+    assert s3.calls == []
+    assert stats["orphans"] == 0
+
+
+def test_orphaned_sidecar_is_deleted_and_missing_sidecar_rebuilt():
+    rebuilt = []
+
+    def rebuild(pdf_id, file):
+        rebuilt.append(pdf_id)
+        return True
+
+    actual = objects("a.pdf", "b.pdf", "gone.pdf" + SUFFIX)
+    stats, s3 = run(expected("a.pdf", "b.pdf"), actual, rebuild=rebuild)
+    assert s3.calls == [["gone.pdf" + SUFFIX]]
+    assert rebuilt == [1, 2]
+    assert stats["missing_sidecars"] == stats["rebuilt_sidecars"] == 2
+
+
+def test_sidecar_of_missing_pdf_is_not_rebuilt():
+    rebuilt = []
+    stats, _ = run(expected("a.pdf"), [], rebuild=lambda pdf_id, file: rebuilt.append(pdf_id))
+    assert stats["missing_pdfs"] == 1
+    assert stats["missing_sidecars"] == 0
+    assert rebuilt == []
+
+
+def test_duplicate_rows_expect_one_object():
+    stats, s3 = run(expected("a.pdf", "a.pdf"), objects("a.pdf", "a.pdf" + SUFFIX))
+    assert s3.calls == []
+    assert stats["missing_pdfs"] == 0
+
+
+def test_recent_objects_are_kept():
+    actual = objects("new.pdf", modified=NOW) + objects("old.pdf")
+    stats, s3 = run(expected(), actual)
+    assert s3.calls == [["old.pdf"]]
+    assert stats["recent"] == 1
+    assert stats["orphans"] == 1
+
+
+def test_sidecars_in_pdf_key_order_abort():
+    table = rows("a.pdf", "a.pdf-2.pdf")
+    with pytest.raises(reconcile.OutOfOrder):
+        list(reconcile.expected_keys(table, table, sidecar_key))
+
+
+def test_out_of_order_listing_aborts_without_deleting():
+    actual = objects("b.pdf", "a.pdf")
+    with pytest.raises(reconcile.OutOfOrder):
+        run(expected(), actual)
+
+
+def test_out_of_order_table_aborts_without_deleting_queued_orphans():
+    s3 = FakeS3()
+    deleter = reconcile.Deleter(s3, "bucket", dry_run=False)
+    table = [(1, "f", "a.pdf"), (2, "f", "c.pdf"), (3, "f", "b.pdf")]
+    with pytest.raises(reconcile.OutOfOrder):
+        reconcile.diff_objects(
+            reconcile.expected_keys(table, table, sidecar_key),
+            objects("a.pdf", "b.pdf", "c.pdf"),
+            deleter,
+            CUTOFF,
+        )
+    # "b.pdf" looked orphaned before the table went backwards
+    assert s3.calls == []
+    assert deleter.batch == []
+
+
+def test_deletes_are_sent_in_batches_of_1000():
+    actual = objects(*[f"orphan-{i:05d}.pdf" for i in range(2500)])
+    stats, s3 = run(expected(), actual)
+    assert [len(call) for call in s3.calls] == [1000, 1000, 500]
+    assert stats["orphans"] == 2500
+    assert stats["orphan_bytes"] == 25000
+
+
+def test_dry_run_counts_without_deleting():
+    actual = objects(*[f"orphan-{i:05d}.pdf" for i in range(1001)])
+    stats, s3 = run(expected(), actual, dry_run=True)
+    assert s3.calls == []
+    assert stats["orphans"] == 1001
+    assert stats["orphan_bytes"] == 10010
+    assert stats["delete_errors"] == 0
+
+
+def test_failed_deletes_are_not_counted_as_reclaimed():
+    stats, s3 = run(expected(), objects("x.pdf", "y.pdf"), fail={"y.pdf"})
+    assert s3.calls == [["x.pdf", "y.pdf"]]
+    assert stats["orphans"] == 1
+    assert stats["orphan_bytes"] == 10
+    assert stats["delete_errors"] == 1
+
+
+def test_percent_encoded_url_protects_the_decoded_key():
+    # Stored as "a%20b.pdf" while the object (and page text) is at "a b.pdf"
+    table = [(1, "https://bucket.s3.amazonaws.com/a%20b.pdf", "a%20b.pdf")]
+    decoded = [(1, table[0][1], "a b.pdf")]
+    stats, s3 = run(
+        reconcile.expected_keys(table, table, sidecar_key, decoded),
+        objects("a b.pdf", "a b.pdf" + SUFFIX),
+    )
+    assert s3.calls == []
+    assert stats["missing_pdfs"] == stats["missing_sidecars"] == 0
+
+
+def test_literal_percent_in_key_is_not_an_orphan():
+    # An uploaded file named "report%41.pdf" is stored under exactly that key
+    table = [(1, "https://bucket.s3.amazonaws.com/report%41.pdf", "report%41.pdf")]
+    decoded = [(1, table[0][1], "reportA.pdf")]
+    stats, s3 = run(
+        reconcile.expected_keys(table, table, sidecar_key, decoded),
+        objects("report%41.pdf", "report%41.pdf" + SUFFIX, "reportB.pdf"),
+    )
+    assert s3.calls == [["reportB.pdf"]]
+    assert stats["missing_pdfs"] == stats["missing_sidecars"] == 0
+
+
+def test_percent_encoded_row_missing_under_both_keys_is_reported_once():
+    rebuilt = []
+    table = [(1, "https://bucket.s3.amazonaws.com/a%20b.pdf", "a%20b.pdf")]
+    decoded = [(1, table[0][1], "a b.pdf")]
+    stats, _ = run(
+        reconcile.expected_keys(table, table, sidecar_key, decoded),
+        [],
+        rebuild=lambda pdf_id, file: rebuilt.append(pdf_id),
+    )
+    assert stats["missing_pdfs"] == 1
+    assert stats["missing_sidecars"] == 0
+    assert rebuilt == []
+
+
+def test_unsorted_listing_found_after_full_batches_deletes_nothing():
+    # Over 1000 orphans come before the listing goes backwards
+    orphans = objects(*[f"orphan-{i:05d}.pdf" for i in range(1500)])
+    s3 = FakeS3()
+
+    def streams():
+        return expected(), orphans + objects("a.pdf")
+
+    with pytest.raises(reconcile.OutOfOrder):
+        reconcile.diff_and_delete(streams, s3, "bucket", dry_run=False, cutoff=CUTOFF)
+    assert s3.calls == []
+
+
+def test_delete_pass_runs_after_a_clean_dry_pass():
+    s3 = FakeS3()
+    passes = []
+
+    def streams():
+        passes.append(1)
+        return expected("a.pdf"), objects("a.pdf", "a.pdf" + SUFFIX, "b.pdf")
+
+    stats = reconcile.diff_and_delete(streams, s3, "bucket", dry_run=False, cutoff=CUTOFF)
+    assert len(passes) == 2
+    assert s3.calls == [["b.pdf"]]
+    assert stats["orphans"] == 1
+
+
+def test_dry_run_makes_one_pass():
+    s3 = FakeS3()
+    passes = []
+
+    def streams():
+        passes.append(1)
+        return expected(), objects("b.pdf")
+
+    stats = reconcile.diff_and_delete(streams, s3, "bucket", dry_run=True, cutoff=CUTOFF)
+    assert len(passes) == 1
+    assert s3.calls == []
+    assert stats["orphans"] == 1
@@ -0,0 +1,168 @@
+# tune_chunking.py
+"""
+Offline search for the chunking settings of a PDF.
+
+Every (strategy, chunk_size, chunk_overlap) combination is indexed and the
+held-out questions are run against it. Among the settings whose retrieval
+recall is within --tolerance of the best one, the script picks the one with
+the fewest prompt tokens, then the smallest index.
+
+The questions file holds one JSON object per line:
+
+    {"question": "What causes hay fever?", "answer": "pollen", "page": 3}
+
+A question counts as answered when a retrieved chunk contains `answer`
+(case-insensitive) or, if given, comes from `page`.
+
+Usage:
+    python tune_chunking.py --pdf-file allergic.pdf --questions questions.jsonl
+    python tune_chunking.py --pdf-id 6 --questions questions.jsonl --apply
+"""
+import argparse
+import itertools
+import json
+
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv()
+
+import chunking
+import embeddings as embedding_backends
+import page_text
+
+
+def load_questions(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+class CachedEmbedder:
+    """Embeds each distinct text once across all evaluated settings"""
+
+    def __init__(self, embeddings):
+        self.embeddings = embeddings
+        self.vectors = {}
+
+    def embed(self, texts):
+        missing = list(dict.fromkeys(t for t in texts if t not in self.vectors))
+        if missing:
+            for text, vector in zip(missing, self.embeddings.embed_documents(missing)):
+                self.vectors[text] = vector
+        return np.array([self.vectors[t] for t in texts], dtype="float32")
+
+
+def evaluate(pages, questions, query_vectors, embedder, strategy, chunk_size, chunk_overlap, k):
+    import faiss
+
+    docs = chunking.split_pages(pages, strategy, chunk_size, chunk_overlap)
+    if not docs:
+        return None
+    texts = [doc.page_content for doc in docs]
+    vectors = embedder.embed(texts)
+    index = faiss.IndexFlatL2(vectors.shape[1])
+    index.add(vectors)
+    # All questions are searched in one call
+    _, ids = index.search(query_vectors, min(k, len(docs)))
+
+    token_counts = chunking.count_tokens(texts)
+    hits = 0
+    prompt_tokens = 0
+    for question, row in zip(questions, ids):
+        row = [i for i in row if i >= 0]
+        prompt_tokens += sum(token_counts[i] for i in row)
+        answer = (question.get("answer") or "").lower()
+        if any(
+            (answer and answer in texts[i].lower()) or docs[i].metadata["page"] == question.get("page")
+            for i in row
+        ):
+            hits += 1
+    return {
+        "strategy": strategy,
+        "chunk_size": chunk_size,
+        "chunk_overlap": chunk_overlap,
+        "chunks": len(docs),
+        "index_bytes": int(vectors.nbytes),
+        "recall": hits / len(questions),
+        "prompt_tokens": prompt_tokens / len(questions),
+    }
+
+
+def pick_best(results, tolerance):
+    best_recall = max(r["recall"] for r in results)
+    candidates = [r for r in results if r["recall"] >= best_recall - tolerance]
+    return min(candidates, key=lambda r: (r["prompt_tokens"], r["index_bytes"]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--pdf-file", help="Local PDF file")
+    source.add_argument("--pdf-id", type=int, help="ID of a stored PDF")
+    parser.add_argument("--questions", required=True, help="JSON lines file of held-out questions")
+    parser.add_argument("--strategies", default=",".join(chunking.STRATEGIES))
+    parser.add_argument("--sizes", default="250,500,750,1000,1500")
+    parser.add_argument("--overlaps", default="0,50,100,200")
+    parser.add_argument("-k", type=int, default=3)
+    parser.add_argument("--tolerance", type=float, default=0.02, help="Recall allowed below the best setting")
+    parser.add_argument("--apply", action="store_true", help="Save the chosen settings on the PDF (--pdf-id only)")
+    args = parser.parse_args()
+
+    db = None
+    db_pdf = None
+    if args.pdf_id is not None:
+        import crud
+        from database import SessionLocal
+        db = SessionLocal()
+        db_pdf = crud.read_pdf(db, args.pdf_id)
+        if db_pdf is None:
+            parser.error(f"PDF {args.pdf_id} not found")
+        pages = page_text.get_pages(db_pdf)
+    else:
+        with open(args.pdf_file, "rb") as f:
+            pages = page_text.extract_pages(f.read())
+
+    questions = load_questions(args.questions)
+    embedder = CachedEmbedder(embedding_backends.get_embeddings())
+    query_vectors = np.array(
+        embedder.embeddings.embed_documents([q["question"] for q in questions]), dtype="float32"
+    )
+
+    results = []
+    grid = itertools.product(
+        args.strategies.split(","),
+        [int(s) for s in args.sizes.split(",")],
+        [int(o) for o in args.overlaps.split(",")],
+    )
+    for strategy, size, overlap in grid:
+        if overlap >= size:
+            continue
+        result = evaluate(pages, questions, query_vectors, embedder, strategy, size, overlap, args.k)
+        if result is None:
+            continue
+        results.append(result)
+        print(
+            f"{strategy:<14} size {size:>5} overlap {overlap:>4}: recall {result['recall']:.2f}, "
+            f"{result['prompt_tokens']:.0f} prompt tokens, {result['chunks']} chunks, "
+            f"{result['index_bytes'] / 1024:.0f} KiB index"
+        )
+
+    if not results:
+        print("No chunking setting produced any chunks")
+        return
+    best = pick_best(results, args.tolerance)
+    print("-" * 50)
+    print(f"Best: {json.dumps(best)}")
+
+    if args.apply and db_pdf is not None:
+        db_pdf.chunk_strategy = best["strategy"]
+        db_pdf.chunk_size = best["chunk_size"]
+        db_pdf.chunk_overlap = best["chunk_overlap"]
+        db.commit()
+        print(f"Saved chunking settings on PDF {db_pdf.id}")
+    if db is not None:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -21,21 +21,9 @@ export default function PDFComponent(props) {
         onChange={(e) => onChange(e, pdf.id)}
       />
       <a
-        onClick={(e) => {
-          e.preventDefault();
-          fetch(`${process.env.NEXT_PUBLIC_API_URL}/pdfs/${pdf.id}/presigned-url`)
-            .then(res => res.json())
-            .then(data => {
-              // Open PDF in new tab with temporary URL
-              window.open(data.url, '_blank');
-            })
-            .catch(err => {
-              console.error("Error getting presigned URL:", err);
-              // Fallback to original URL if error
-              window.open(pdf.file, '_blank');
-            });
-        }}
-        href="#"
+        href={`${process.env.NEXT_PUBLIC_API_URL}/pdfs/${pdf.id}/content?v=${pdf.version}`}
+        target="_blank"
+        rel="noreferrer"
         className={styles.viewPdfLink}
       >
         <Image src="/document-view.svg" width="22" height="22" />